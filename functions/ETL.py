@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 import gzip 
 import json
+import ast
 
 def gzip_json_file(
         path:str ='./',
@@ -36,20 +37,61 @@ def gzip_json_file(
 
     print(f'File saved at "{path[2:]}"')
 
+# Parsing a single line of json.gz files
+def _parse_line(line:str | bytes):
+    """Private method. Parses a json line, falling back to a safe
+    Python literal parser for the Python-repr lines of the raw Steam
+    files (single quotes, True/False/None...)."""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return ast.literal_eval(line)
+
+
+# Streaming json.gz files
+def iter_json_gz(path = str, chunksize:int = 10000, as_frame=False, **kargs):
+    """Generator reading '.json.gz files' (a json per row)
+    in chunks, so only one chunk of records is held in memory
+    at the same time.
+
+    ## Parametters:
+    - path: File location and name.
+    - chunksize: Number of records per chunk.
+    - as_frame: If ``True`` every chunk is yielded as a pd.DataFrame
+    instead of a list of dicts.
+    - kargs: passed to ``gzip.open`` (text mode by default)."""
+
+    kargs.setdefault('mode', 'rt')
+
+    with gzip.open(path, **kargs) as file:
+        chunk = []
+        for line in file:
+            if not line.strip():
+                continue
+            chunk.append(_parse_line(line))
+
+            if len(chunk) == chunksize:
+                yield pd.DataFrame(chunk) if as_frame else chunk
+                chunk = []
+
+        # Last records
+        if chunk:
+            yield pd.DataFrame(chunk) if as_frame else chunk
+
+
 # Loading json.gz files
 def load_json_gz(path = str, **kargs):
     """Open and read '.json.gz files', returning
     a list containing every json (it should be a 
-    json-per-row) in the file."""
+    json-per-row) in the file.
+    
+    Lines are streamed with ``iter_json_gz``."""
 
-   # Read file, returning a list of strings per row
-    with gzip.open(path, **kargs) as file:
-        data = file.readlines()
-    # Converting each row to a dict
-    try:
-        data = [eval(line) for line in data]
-    except NameError:
-        data = [json.loads(line) for line in data]
+    data = []
+    for chunk in iter_json_gz(path, **kargs):
+        data += chunk
 
     # If success, show # of records
     print('Number of records:', len(data))
@@ -58,12 +100,41 @@ def load_json_gz(path = str, **kargs):
 
 
 # Function to handle nested json in files:
+def _unpack(
+        df:pd.DataFrame,
+        where: str,
+        values: list[str],
+        old_colums: list[str] | None,
+        ) -> pd.DataFrame:
+    """Private method. Vectorized unpacking used by ``json_unpacking``
+    and ``iter_json_unpacking``."""
+
+    old_colums = list(old_colums or [])
+
+    # One row per nested dictionary. Empty arrays become nulls and are dropped
+    exploded = (
+        df[old_colums + [where]]
+        .explode(where, ignore_index=True)
+        .dropna(subset=[where])
+    )
+
+    # Keeping only the values passed from every dictionary
+    unpacked = pd.DataFrame.from_records(exploded[where].tolist(), columns=values)
+
+    # Original columns are placed first
+    items = pd.concat(
+        [exploded[old_colums].reset_index(drop=True), unpacked],
+        axis=1
+    )
+    return items
+
+
 def json_unpacking(
         df:pd.DataFrame,
         where: str,
         values: list[str],
         old_colums: list[str] | None,
-        ) -> list[dict]:
+        ) -> pd.DataFrame:
     """Unpacks dictionaries within the given column (`where`
     the json objects are), returning a higher dimensional 
     DataFrame where eache value from json's `values` is a 
@@ -79,66 +150,328 @@ def json_unpacking(
         from the DataFrame; **always a list** -> for a single label:``['label']``
         should be passed."""
     
-    # UNPACKING LOOP:
-    items = []
-    # For each row in data
-    for i in df.index:
-        row = {}
-        if old_colums is not None:
-            row = {label: df.loc[i,label] for label in old_colums}
-        # for each item inside
-        for item in df.loc[i, where]:
-            # Keeping only values passed
-            for value in values:
-                row[value] = item[value]
-            items.append(dict(row)) # A copy must be appended.
-
-    # DataFrame again
-    items = pd.DataFrame(items)
+    items = _unpack(df, where, values, old_colums)
+
     # If success, print the shape of the resulting DataFrame.    
     print('Shape of the resulting array:', items.shape)
     return items 
 
+
+def iter_json_unpacking(
+        chunks,
+        where: str,
+        values: list[str],
+        old_colums: list[str] | None,
+        ):
+    """Chunked version of ``json_unpacking``. Takes an iterable
+    of DataFrames (e.g. ``iter_json_gz(path, as_frame=True)``) and
+    yields every chunk already unpacked, so nested files can be
+    processed with bounded memory.
+    
+    Parametters are the same as ``json_unpacking``."""
+
+    for chunk in chunks:
+        yield _unpack(chunk, where, values, old_colums)
+
 import sys
+import os
+
+# Parquet support is optional, gzip files are used without it
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# List columns of games. 'Empty' labels are stored as nulls in parquet files
+LIST_COLUMNS = ['genres', 'tags', 'specs']
+
+
+def data_paths(from_main=False, format='gzip'):
+    """Paths of the dataset files.
+
+    ``format``: 'gzip' for the original files or 'parquet'
+    for the columnar ones."""
+
+    if format == 'parquet':
+        paths = {
+            'games': '../data/games.parquet',
+            'reviews': '../data/reviews.parquet',
+            'items': '../data/items.parquet'
+        }
+    else:
+        paths = {
+            'games': '../data/games.json.gz',
+            'reviews': '../data/reviews.csv.gz',
+            'items': '../data/items.csv.gz'
+        }
+
+    if from_main:
+        paths = {name: path[3:] for name, path in paths.items()}
+
+    return paths
+
+
+def _read_parquet(path:str, columns:list[str] | None = None, memory_map=False):
+    """Private method. Reads a parquet file written by ``save_parquet``,
+    restoring the original values of games columns."""
+
+    df = pd.read_parquet(path, columns=columns, memory_map=memory_map)
+
+    # Lists come back as arrays, nulls were 'Empty' labels
+    for col in LIST_COLUMNS:
+        if col in df.columns:
+            df[col] = [
+                'Empty' if value is None else value.tolist() for value in df[col]
+            ]
+
+    # Prices were stored as strings, numbers are restored
+    if 'price' in df.columns:
+        numeric = pd.to_numeric(df['price'], errors='coerce')
+        df['price'] = numeric.astype(object).where(numeric.notna(), df['price'])
+
+    return df
+
+
+def load_df(name:str, from_main=False, columns:list[str] | None = None, memory_map=False):
+    """Read a single dataset ('games', 'reviews' or 'items').
+
+    The columnar parquet file is used when it exists (and pyarrow is
+    installed), reading only ``columns`` (all of them if ``None``) and
+    optionally memory-mapped. The original gzip file is the fallback."""
+
+    path = data_paths(from_main, format='parquet')[name]
+    if pyarrow is not None and os.path.exists(path):
+        return _read_parquet(path, columns=columns, memory_map=memory_map)
+
+    path = data_paths(from_main, format='gzip')[name]
+    if name == 'games':
+        df = pd.read_json(path, compression='gzip', lines=True)
+    else:
+        df = pd.read_csv(path, compression='gzip', usecols=columns)
+
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+def save_parquet(path:str, df:pd.DataFrame, subset:list = None):
+    """Saving a DataFrame to a typed columnar parquet file.
+
+    List columns of games are kept as native lists ('Empty' labels
+    are stored as nulls) and mixed prices are stored as strings, so
+    ``load_df`` can restore the original values.
+
+    ## Parametters:
+    - path: File location and name.
+    - df: pd.Dataframe to save.
+    - subset:Optional. Subset of columns to be saved."""
+
+    if subset is not None:
+        df = df[subset]
+    df = df.copy()
+
+    for col in LIST_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].map(lambda value: value if isinstance(value, list) else None)
+
+    if 'price' in df.columns:
+        df['price'] = df['price'].map(str, na_action='ignore')
+
+    df.to_parquet(path, index=False)
+    print(f'File saved at "{path}"')
+
+
+def export_parquet(from_main=False):
+    """Converts every gzip dataset file into its parquet version."""
+
+    gzip_paths = data_paths(from_main, format='gzip')
+    for name, path in data_paths(from_main, format='parquet').items():
+        if os.path.exists(gzip_paths[name]):
+            save_parquet(path, load_df(name, from_main))
+
+
+# ----------
+# Compact dtypes
+
+def _compact_series(series:pd.Series, category_ratio:float):
+    """Private method. Smallest dtype keeping every value of ``series``."""
+
+    if pd.api.types.is_bool_dtype(series):
+        return series
+
+    if pd.api.types.is_float_dtype(series):
+        # Whole numbers without nulls (e.g. sentiment labels) become integers
+        if series.notna().all() and (series == series.round()).all():
+            return pd.to_numeric(series.astype(np.int64), downcast='integer')
+        return pd.to_numeric(series, downcast='float')
+
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast='integer')
+
+    # Repeated strings as categorical codes. Lists and mixed
+    # columns (e.g. prices) are kept as they are
+    if series.dtype == object and len(series):
+        is_str = series.map(lambda value: isinstance(value, str))
+        if is_str.all() and series.nunique() <= category_ratio * len(series):
+            return series.astype('category')
+
+    return series
+
+
+def compact_df(df:pd.DataFrame, category_ratio:float = 0.5):
+    """Returns a copy of ``df`` using less memory:
+        - Integers downcast to the smallest width (e.g. int32 ids).
+        - Floats downcast to float32, or to integers if every value is whole.
+        - String columns with repeated values (unique values up to
+        ``category_ratio`` of the rows) as categoricals.
+
+    List columns are not changed, see ``CodedLists``. Groupbys over
+    categorical columns should use ``observed=True``."""
+
+    return pd.DataFrame(
+        {col: _compact_series(df[col], category_ratio) for col in df.columns},
+        index=df.index
+    )
+
+
+def append_rows(df:pd.DataFrame, delta:pd.DataFrame, ignore_index=True):
+    """Appends the rows of ``delta`` (same columns) to ``df``, keeping
+    categorical columns categorical (new values are added to their
+    categories). Returns a new DataFrame."""
+
+    delta = delta[df.columns].copy()
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            categories = df[col].cat.categories.union(pd.Index(delta[col].dropna().unique()))
+            df[col] = df[col].cat.set_categories(categories)
+            delta[col] = delta[col].astype(df[col].dtype)
+
+    return pd.concat([df, delta], ignore_index=ignore_index)
+
+
+def memory_report(dfs:dict):
+    """Prints and returns the memory (MB) used by every DataFrame in
+    ``dfs`` (name -> DataFrame), strings and lists included."""
+
+    report = pd.Series({
+        name: df.memory_usage(deep=True).sum() / 2**20 for name, df in dfs.items()
+    }).round(2)
+    for name, mb in report.items():
+        print(f'{name}: {dfs[name].shape} {mb} MB')
+    if len(report) > 1:
+        print(f'Total: {report.sum():.2f} MB')
+    return report
+
+
+class CodedLists:
+    """List column (e.g. 'genres' or 'specs') stored as integer codes.
+
+    Every label is stored once in ``vocabulary``, and the labels of all
+    rows are one flat array of ``codes`` where row ``i`` owns
+    ``codes[offsets[i]:offsets[i + 1]]``. Rows without a list (the 'Empty'
+    label) are flagged in ``empty``. Rows are found by the ``index``
+    labels of the original DataFrame, so filtered frames still match."""
+
+    def __init__(self, vocabulary:np.ndarray, codes:np.ndarray, offsets:np.ndarray, empty:np.ndarray, index:pd.Index):
+        self.vocabulary = vocabulary
+        self.codes = codes
+        self.offsets = offsets
+        self.empty = empty
+        self.index = index
+
+    @classmethod
+    def from_series(cls, series:pd.Series):
+        """Encodes a list column. Non-list values are stored as empty."""
+        empty = ~series.map(lambda value: isinstance(value, list)).to_numpy()
+        lists = series.where(~empty, None).map(lambda value: value or [])
+
+        lengths = lists.map(len).to_numpy()
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        labels = pd.Series([label for values in lists for label in values], dtype=object)
+        codes, vocabulary = pd.factorize(labels, sort=True)
+        dtype = np.int16 if len(vocabulary) < 2**15 else np.int32
+
+        return cls(np.asarray(vocabulary, dtype=object), codes.astype(dtype), offsets, empty, series.index)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.offsets.nbytes + self.empty.nbytes
+
+    def _positions(self, labels):
+        """Private method. Positions of the rows with these index labels."""
+        positions = self.index.get_indexer(labels)
+        if (positions < 0).any():
+            raise KeyError('Some labels are not in the index')
+        return positions
+
+    def _row(self, position:int):
+        """Private method. Original value of the row at ``position``."""
+        if self.empty[position]:
+            return 'Empty'
+        codes = self.codes[self.offsets[position]:self.offsets[position + 1]]
+        return self.vocabulary[codes].tolist()
+
+    def get(self, label):
+        """Original value of one row: a list of labels or 'Empty'."""
+        return self._row(self._positions([label])[0])
+
+    def to_series(self, labels = None):
+        """Original list column (all rows, or only ``labels``)."""
+        labels = self.index if labels is None else pd.Index(labels)
+        return pd.Series([self._row(position) for position in self._positions(labels)], index=labels)
+
+    def explode(self):
+        """One pair per (row, label): arrays of row positions and codes."""
+        rows = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        return rows, self.codes
+
+
+def encode_lists(df:pd.DataFrame, columns:list[str] = LIST_COLUMNS):
+    """``CodedLists`` for every list column of ``df`` found in ``columns``."""
+    return {col: CodedLists.from_series(df[col]) for col in columns if col in df.columns}
+
 
 # Loading data all at once function:
-def load_dfs(from_main=False):
+def load_dfs(from_main=False, columns:dict | None = None, memory_map=False, compact=False):
     """Read dataset files and return consumible
     DaFrames.
-    
-    Order: ``games``, ``reviews``, ``items``"""
 
-    sys.path.append('../')
+    Parquet files are read when available (see ``load_df``).
+    ``columns`` is an optional dict with the columns to read
+    for each dataset, e.g. ``{'games': ['item_id', 'genres']}``.
 
-    paths = {
-        'games': '../data/games.json.gz',
-        'reviews': '../data/reviews.csv.gz',
-        'items': '../data/items.csv.gz'
-    }
+    With ``compact=True`` every DataFrame goes through ``compact_df``,
+    the list columns of games are moved into ``CodedLists`` (returned
+    as a fourth value, a dict column -> ``CodedLists``) and the memory
+    used by each DataFrame is printed.
     
-    if from_main:
-        paths['games'] = paths['games'][3:]
-        paths['reviews'] = paths['reviews'][3:]
-        paths['items'] = paths['items'][3:]
-
-    games = pd.read_json(
-        paths['games'],
-        compression='gzip',
-        lines=True
-    )
+    Order: ``games``, ``reviews``, ``items`` (, ``lists``)"""
 
-    reviews = pd.read_csv(
-        paths['reviews'],
-        compression='gzip',
-    )
+    sys.path.append('../')
+    columns = columns or {}
 
-    items = pd.read_csv(
-        paths['items'],
-        compression='gzip',
+    games, reviews, items = (
+        load_df(name, from_main, columns=columns.get(name), memory_map=memory_map)
+        for name in ['games', 'reviews', 'items']
     )
 
     # If success
     print('DataFrames succesfully loaded.')
+
+    if compact:
+        lists = encode_lists(games)
+        games = compact_df(games.drop(columns=list(lists)))
+        reviews, items = compact_df(reviews), compact_df(items)
+        memory_report({'games': games, 'reviews': reviews, 'items': items})
+        print(f'Lists: {sum(coded.nbytes for coded in lists.values()) / 2**20:.2f} MB')
+        return games, reviews, items, lists
+
     return games, reviews, items
 
 # Getting the year for games dataset
@@ -148,7 +481,8 @@ def get_year(y:str):
     
     It should be used as callable argument to 
     pass in ``pd.DataFrame.map() `` or 
-    ``pd.DataFrame.apply()``"""
+    ``pd.DataFrame.apply()``. For whole columns
+    ``extract_years`` is much faster."""
     # There are different formats along the column
     # And also strings from filling Na values before
     # Using exception handling to avoid errors and return years
@@ -156,5 +490,57 @@ def get_year(y:str):
         date = pd.to_datetime(y, format='mixed')
         year = date.year
         return year
-    except:
-        return np.nan
\ No newline at end of file
+    except (ValueError, TypeError, OverflowError, AttributeError):
+        return np.nan
+
+
+def extract_years(dates:pd.Series, return_report=False):
+    """Column-level version of ``get_year``. Extracts the release
+    year of every value in the 'release_date' column in a few
+    vectorized passes:
+
+        1. 'YYYY-MM-DD' dates (almost every value).
+        2. Plain years ('YYYY').
+        3. Any other format, parsing every distinct string only once.
+
+    The number of values that could not be parsed is printed.
+
+    ## Parametters
+    - ``dates``: Series of release dates.
+    - ``return_report``: If ``True`` returns a tuple ``(years, report)``
+    where ``report`` is a dict with the number of values parsed by each
+    pass, null values and unparseable values."""
+
+    # Only strings can be parsed
+    strings = dates.map(lambda d: d if isinstance(d, str) else None).astype('string').str.strip()
+    years = pd.Series(np.nan, index=dates.index, dtype=float)
+
+    # 1. Fast path for ISO dates
+    iso = strings.str.fullmatch(r'\d{4}-\d{2}-\d{2}', na=False)
+    years[iso] = pd.to_datetime(strings[iso], format='%Y-%m-%d', errors='coerce').dt.year
+
+    # 2. Plain years
+    plain = strings.str.fullmatch(r'[12]\d{3}', na=False)
+    years[plain] = strings[plain].astype(int)
+
+    # 3. Other formats, each distinct string is parsed once
+    other = strings.notna() & ~iso & ~plain
+    unique = strings[other].unique()
+    parsed = pd.Series(
+        pd.to_datetime(pd.Series(unique, dtype=object), format='mixed', errors='coerce').dt.year.to_numpy(),
+        index=unique
+    )
+    years[other] = strings[other].map(parsed)
+
+    report = {
+        'iso': int(iso.sum()),
+        'plain_year': int(plain.sum()),
+        'other': int(years[other].notna().sum()),
+        'null': int(dates.isna().sum()),
+        'unparseable': int((dates.notna() & years.isna()).sum())
+    }
+    print(f"Years extracted. Unparseable values: {report['unparseable']} (null values: {report['null']})")
+
+    if return_report:
+        return years, report
+    return years
@@ -0,0 +1,321 @@
+import pandas as pd
+import numpy as np
+from bisect import bisect_left
+
+
+def explode_genres(games:pd.DataFrame, columns:list[str] = ['item_id', 'release_year']):
+    """Returns one row per (game, genre) pair with a new 'genre' column.
+
+    Games without genres (labeled as 'Empty') are dropped.
+
+    ## Parametters
+    - ``games``: games DataFrame.
+    - ``columns``: columns of games kept in the result."""
+
+    exploded = (
+        games[columns + ['genres']]
+        .loc[games['genres'].map(lambda genres: isinstance(genres, list))]
+        .explode('genres')
+        .rename(columns={'genres': 'genre'})
+        .dropna(subset='genre')
+    )
+    return exploded
+
+
+def genre_playtime_tables(games:pd.DataFrame, items:pd.DataFrame):
+    """Builds the aggregates used by ``PlayTimeGenre`` and ``UserForGenre``
+    so both endpoints are dictionary lookups.
+
+    Genres are exploded and joined with ``items`` only once. Returns a dict:
+        ``playtime_year``: (genre, release_year) -> playtime.
+        ``user_playtime``: (genre, user_id) -> playtime.
+        ``top_year``: genre -> release year with the highest playtime.
+        ``top_user``: genre -> user with the highest playtime.
+        ``top_user_years``: genre -> playtime per release year of ``top_user``."""
+
+    # One row per (played item, genre)
+    merged = (
+        items[['user_id', 'item_id', 'playtime_forever']]
+        .merge(explode_genres(games), how='inner', on='item_id')
+    )
+
+    # (genre, year) and (genre, user) aggregates. Only observed pairs
+    # are kept if user_id is categorical (see ``ETL.compact_df``)
+    playtime_year = merged.groupby(['genre', 'release_year'], observed=True)['playtime_forever'].sum()
+    user_playtime = merged.groupby(['genre', 'user_id'], observed=True)['playtime_forever'].sum()
+
+    # Maximum per genre. idxmax keeps the first of ties (the lowest year)
+    # (idxmax returns the whole (genre, ...) label)
+    top_year = dict(playtime_year.groupby(level='genre').idxmax().tolist())
+    top_user = dict(user_playtime.groupby(level='genre').idxmax().tolist())
+
+    # Playtime per year only for the top user of each genre
+    top_pairs = pd.DataFrame(top_user.items(), columns=['genre', 'user_id'])
+    top_user_years = {
+        genre: years.droplevel('genre')
+        for genre, years in (
+            merged.merge(top_pairs, how='inner', on=['genre', 'user_id'])
+            .groupby(['genre', 'release_year'], observed=True)['playtime_forever']
+            .sum()
+            .groupby(level='genre')
+        )
+    }
+
+    print('Genre playtime tables built.')
+    return {
+        'playtime_year': playtime_year,
+        'user_playtime': user_playtime,
+        'top_year': top_year,
+        'top_user': top_user,
+        'top_user_years': top_user_years
+    }
+
+
+def update_genre_tables(tables:dict, games:pd.DataFrame, items_delta:pd.DataFrame, items:pd.DataFrame):
+    """New genre playtime tables with the playtime of ``items_delta`` added,
+    without rebuilding them. ``tables`` is not changed.
+
+    Sums are updated with the new rows only, and tops are recomputed only
+    for the genres of those rows. ``items`` (already including the delta)
+    is read only for the playtime per year of the new top users."""
+
+    merged = (
+        items_delta[['user_id', 'item_id', 'playtime_forever']]
+        .merge(explode_genres(games), how='inner', on='item_id')
+    )
+    if merged.empty:
+        return tables
+
+    def add(total, keys):
+        delta = merged.groupby(keys, observed=True)['playtime_forever'].sum()
+        return total.add(delta, fill_value=0).astype(total.dtype).sort_index()
+
+    playtime_year = add(tables['playtime_year'], ['genre', 'release_year'])
+    user_playtime = add(tables['user_playtime'], ['genre', 'user_id'])
+
+    # Tops of the genres with new playtime
+    genres = list(merged['genre'].unique())
+    top_year = {
+        **tables['top_year'],
+        **dict(playtime_year.loc[genres].groupby(level='genre').idxmax().tolist())
+    }
+    new_top_user = dict(user_playtime.loc[genres].groupby(level='genre').idxmax().tolist())
+    top_user = {**tables['top_user'], **new_top_user}
+
+    # Playtime per year of the top users, from every item they played
+    top_pairs = pd.DataFrame(new_top_user.items(), columns=['genre', 'user_id'])
+    played = (
+        items.loc[items['user_id'].isin(top_pairs['user_id']), ['user_id', 'item_id', 'playtime_forever']]
+        .astype({'user_id': object})
+        .merge(explode_genres(games), how='inner', on='item_id')
+        .merge(top_pairs, how='inner', on=['genre', 'user_id'])
+    )
+    top_user_years = {
+        **tables['top_user_years'],
+        **{
+            genre: years.droplevel('genre')
+            for genre, years in (
+                played.groupby(['genre', 'release_year'])['playtime_forever']
+                .sum()
+                .groupby(level='genre')
+            )
+        }
+    }
+
+    print(f'Genre playtime tables updated for {len(genres)} genres.')
+    return {
+        'playtime_year': playtime_year,
+        'user_playtime': user_playtime,
+        'top_year': top_year,
+        'top_user': top_user,
+        'top_user_years': top_user_years
+    }
+
+
+def review_year_tables(games:pd.DataFrame, reviews:pd.DataFrame, top:int = 3):
+    """Builds the per-year rankings used by ``UsersRecommend`` and
+    ``UsersWorstDeveloper``, so both endpoints are dictionary lookups.
+
+    It must be rebuilt every time ``reviews`` is reloaded. Returns a dict:
+        ``recommended``: year -> ``top`` games by sum of sentiment among
+        recommended, positive/neutral reviews.
+        ``worst_developers``: year -> ``top`` developers by number of
+        not recommended, negative reviews."""
+
+    # Recommended games with positive/neutral reviews
+    recommended = (
+        reviews.loc[(reviews['recommend'] == True) & (reviews['sentiment'] > 0)]
+        .merge(games[['item_id', 'app_name', 'release_year']], how='left', on='item_id')
+        .groupby(['release_year', 'app_name'], observed=True)['sentiment']
+        .sum()
+    )
+
+    # Not recommended games with negative reviews
+    negative = (
+        reviews.loc[(reviews['recommend'] == False) & (reviews['sentiment'] == 0)]
+        .merge(games[['item_id', 'release_year', 'developer']], how='left', on='item_id')
+        # Counting categorical developers would list every category
+        .astype({'developer': object})
+    )
+
+    # Sorting every year on its own keeps the order of ties
+    # exactly as if the year was filtered on request.
+    recommended = {
+        int(year): tuple(
+            titles.droplevel('release_year').sort_values(ascending=False)[:top].index
+        )
+        for year, titles in recommended.groupby(level='release_year')
+    }
+    worst_developers = {
+        int(year): tuple(developers.value_counts()[:top].index)
+        for year, developers in negative.groupby('release_year')['developer']
+    }
+
+    print('Review year tables built.')
+    return {
+        'recommended': recommended,
+        'worst_developers': worst_developers
+    }
+
+
+def update_review_tables(tables:dict, games:pd.DataFrame, reviews:pd.DataFrame, item_ids, top:int = 3):
+    """New per-year rankings after reviews of ``item_ids`` were added to
+    ``reviews``. Only the release years of those items are recomputed,
+    from the reviews of the games released in them. ``tables`` is not
+    changed."""
+
+    years = set(games.loc[games['item_id'].isin(item_ids), 'release_year'].dropna().astype(int))
+    if not years:
+        return tables
+
+    # Every review of every game released in those years
+    year_items = games.loc[games['release_year'].isin(years), 'item_id']
+    partial = review_year_tables(games, reviews[reviews['item_id'].isin(year_items)], top)
+
+    updated = {}
+    for name, table in tables.items():
+        table = {year: value for year, value in table.items() if year not in years}
+        table.update({year: value for year, value in partial[name].items() if year in years})
+        updated[name] = dict(sorted(table.items()))
+
+    print(f'Review year tables updated for years: {sorted(years)}')
+    return updated
+
+
+class DeveloperSentimentIndex:
+    """Count of Negative, Neutral and Positive reviews for every developer,
+    built once with a groupby.
+
+    Developers from ``games`` without reviews in some category get zero
+    for it. Supports exact, case-insensitive and prefix lookups."""
+
+    labels = ['Negative', 'Neutral', 'Positive']
+
+    def __init__(self, games:pd.DataFrame, reviews:pd.DataFrame):
+        # developer -> (negative, neutral, positive)
+        self.counts = self._count(games, reviews)
+        self._build_lookups()
+
+        print(f'Developer sentiment index built for {len(self.counts)} developers.')
+
+    @staticmethod
+    def _count(games:pd.DataFrame, reviews:pd.DataFrame):
+        """Private method. Reviews per developer and sentiment."""
+        counts = (
+            reviews[['item_id', 'sentiment']]
+            .merge(games[['item_id', 'developer']], how='left', on='item_id')
+            .groupby(['developer', 'sentiment'], observed=True)
+            .size()
+            .unstack(fill_value=0)
+            # Every sentiment category and every developer is kept
+            .reindex(index=games['developer'].astype(object).unique(), columns=[0, 1, 2], fill_value=0)
+        )
+        return dict(zip(counts.index, map(tuple, counts.to_numpy().tolist())))
+
+    def _build_lookups(self):
+        """Private method. lowercase name -> developers, and sorted
+        lowercase names for prefixes."""
+        self.lowercase = {}
+        for dev in self.counts:
+            self.lowercase.setdefault(dev.lower(), []).append(dev)
+        self.sorted_lowercase = sorted(self.lowercase)
+
+    def updated(self, games:pd.DataFrame, reviews_delta:pd.DataFrame):
+        """New index with the reviews of ``reviews_delta`` added (and the
+        developers of new ``games``). This index is not changed."""
+        delta = self._count(games, reviews_delta)
+
+        index = DeveloperSentimentIndex.__new__(DeveloperSentimentIndex)
+        index.counts = dict(self.counts)
+        for dev, counts in delta.items():
+            old = index.counts.get(dev, (0, 0, 0))
+            index.counts[dev] = tuple(a + b for a, b in zip(old, counts))
+
+        if len(index.counts) > len(self.counts):
+            index._build_lookups()
+        else:
+            index.lowercase, index.sorted_lowercase = self.lowercase, self.sorted_lowercase
+        return index
+
+    def lookup(self, dev:str, match:str = 'exact'):
+        """Returns ``{developer: (negative, neutral, positive)}`` for the
+        developers matching ``dev``.
+
+        ``match``: 'exact', 'insensitive' (case-insensitive) or
+        'prefix' (case-insensitive prefix)."""
+
+        if match == 'exact':
+            devs = [dev] if dev in self.counts else []
+        elif match == 'insensitive':
+            devs = self.lowercase.get(dev.lower(), [])
+        elif match == 'prefix':
+            prefix = dev.lower()
+            devs = []
+            # Binary search to the first name with the prefix
+            for name in self.sorted_lowercase[bisect_left(self.sorted_lowercase, prefix):]:
+                if not name.startswith(prefix):
+                    break
+                devs += self.lowercase[name]
+        else:
+            raise ValueError(f"Unknown match '{match}'")
+
+        return {name: self.counts[name] for name in devs}
+
+
+class UserLibraries:
+    """Item ids played by every user (from ``items``), stored as one
+    flat array with offsets per user."""
+
+    def __init__(self, items:pd.DataFrame):
+        grouped = items[['user_id', 'item_id']].sort_values('user_id', kind='stable')
+
+        users, starts = np.unique(grouped['user_id'].to_numpy(), return_index=True)
+        self.users = dict(zip(users.tolist(), range(len(users))))
+        self.offsets = np.append(starts, len(grouped))
+        self.item_ids = grouped['item_id'].to_numpy()
+
+        print(f'Libraries built for {len(self.users)} users.')
+
+    def get(self, user_id:str):
+        """Item ids of ``user_id`` (empty if the user is unknown)."""
+        position = self.users.get(user_id)
+        if position is None:
+            return self.item_ids[:0]
+        return self.item_ids[self.offsets[position]:self.offsets[position + 1]]
+
+
+def item_popularity(items:pd.DataFrame, item_ids):
+    """Number of users owning every item of ``item_ids`` (zero for
+    items nobody owns). Used to break ties between recommendations."""
+    owners = items.groupby('item_id')['user_id'].nunique()
+    return owners.reindex(item_ids, fill_value=0).to_numpy()
+
+
+def build_tables(games:pd.DataFrame, reviews:pd.DataFrame, items:pd.DataFrame):
+    """Builds every precomputed table used by the query endpoints."""
+    return {
+        'genre_tables': genre_playtime_tables(games, items),
+        'review_tables': review_year_tables(games, reviews),
+        'developer_index': DeveloperSentimentIndex(games, reviews),
+        'libraries': UserLibraries(items)
+    }
@@ -0,0 +1,114 @@
+import time
+import argparse
+import numpy as np
+
+
+class LSHIndex:
+    """Approximate nearest neighbors index for cosine similarity, based on
+    random-hyperplane Locality Sensitive Hashing.
+
+    Every item is hashed in ``n_tables`` tables with ``n_bits`` random
+    hyperplanes each (one bit per side of the hyperplane). Similar vectors
+    are likely to share a bucket in at least one table, so only the items in
+    the buckets of the query are scored.
+
+    Recall vs latency knob: more ``n_tables`` (or less ``n_bits``) means
+    more candidates per query, higher recall and higher latency."""
+
+    def __init__(self, matrix, n_tables:int = 8, n_bits:int = 12, seed:int = 0):
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+
+        rng = np.random.default_rng(seed)
+        # (features, tables * bits) random hyperplanes
+        self.planes = rng.standard_normal((matrix.shape[1], n_tables * n_bits)).astype(np.float32)
+        # Weight of every bit to turn the signs into an integer code
+        self._weights = (1 << np.arange(n_bits)).astype(np.int64)
+
+        codes = self._codes(matrix @ self.planes)
+
+        # One dict per table: code -> positions of the items in that bucket
+        self.buckets = []
+        for table in range(n_tables):
+            order = np.argsort(codes[:, table], kind='stable')
+            sorted_codes = codes[order, table]
+            unique, starts = np.unique(sorted_codes, return_index=True)
+            self.buckets.append({
+                code: positions
+                for code, positions in zip(unique.tolist(), np.split(order, starts[1:]))
+            })
+
+        print(f'LSH index built: {n_tables} tables of {n_bits} bits.')
+
+    def _codes(self, projections):
+        """Private method. (items, tables) integer bucket codes from
+        the projections over every hyperplane."""
+        signs = (np.asarray(projections) > 0).reshape(-1, self.n_tables, self.n_bits)
+        return signs @ self._weights
+
+    def candidates(self, vector:np.ndarray):
+        """Sorted positions of every item sharing a bucket with ``vector``
+        in at least one table."""
+        codes = self._codes(vector @ self.planes)[0]
+        found = [
+            self.buckets[table].get(code, np.array([], dtype=np.intp))
+            for table, code in enumerate(codes.tolist())
+        ]
+        return np.unique(np.concatenate(found))
+
+
+def benchmark_recall(computer, n:int = 10, sample:int = 200, seed:int = 0):
+    """Compares the approximate engine (``computer.ann`` must be set)
+    against the exact one for ``sample`` random items.
+
+    Identical feature vectors make many exact answers equally valid, so an
+    approximate result counts as a hit when its score is at least the
+    n-th exact score. Returns a dict with the mean recall and the mean
+    latency (ms) of both engines."""
+
+    rng = np.random.default_rng(seed)
+    ids = computer.items['item_id'].to_numpy()
+    ids = rng.choice(ids, size=min(sample, len(ids)), replace=False)
+
+    recall, exact_time, approx_time = [], 0.0, 0.0
+    for id in ids:
+        start = time.perf_counter()
+        exact = computer.n_most_similar(n, id, indexes=True)
+        exact_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        approx = computer.n_most_similar(n, id, indexes=True, approximate=True)
+        approx_time += time.perf_counter() - start
+
+        scores = computer.compute_similarities(id)
+        threshold = scores.loc[exact].min()
+        recall.append((scores.loc[approx] >= threshold).sum() / len(exact))
+
+    return {
+        'recall': float(np.mean(recall)),
+        'exact_ms': exact_time / len(ids) * 1000,
+        'approximate_ms': approx_time / len(ids) * 1000
+    }
+
+
+if __name__ == '__main__':
+    from functions.snapshot import build_state, load_snapshot, snapshot_exists
+
+    parser = argparse.ArgumentParser(description='Recall benchmark of the approximate recommender.')
+    parser.add_argument('--tables', type=int, nargs='+', default=[2, 4, 8, 16], help='Number of tables to test.')
+    parser.add_argument('--bits', type=int, default=12, help='Bits per table.')
+    parser.add_argument('--n', type=int, default=10, help='Number of recommendations.')
+    parser.add_argument('--sample', type=int, default=200, help='Number of items queried.')
+    args = parser.parse_args()
+
+    # Same items matrix as the API
+    state = load_snapshot() if snapshot_exists() else build_state()
+    computer = state['computer']
+
+    for n_tables in args.tables:
+        computer.set_ann(LSHIndex(computer.normMatrix, n_tables=n_tables, n_bits=args.bits))
+        result = benchmark_recall(computer, n=args.n, sample=args.sample)
+        print(
+            f"tables={n_tables} bits={args.bits} recall@{args.n}={result['recall']:.3f} "
+            f"exact={result['exact_ms']:.2f}ms approximate={result['approximate_ms']:.2f}ms"
+        )
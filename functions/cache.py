@@ -0,0 +1,96 @@
+import json
+import time
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+
+
+class CachedResponse:
+    """A cached response: the value returned by the query function and
+    its ETag (hash of the value)."""
+
+    __slots__ = ('value', 'etag', 'expires')
+
+    def __init__(self, value, expires:float | None):
+        self.value = value
+        self.expires = expires
+        content = json.dumps(value, sort_keys=True, default=str).encode()
+        self.etag = f'"{hashlib.sha1(content).hexdigest()}"'
+
+
+def _normalize(value):
+    """Private method. Hashable version of a parameter (lists as tuples)."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(item) for item in value)
+    return value
+
+
+class ResponseCache:
+    """Bounded LRU cache (with optional TTL) in front of the query functions.
+
+    Keys are the function name, its arguments normalized (defaults applied,
+    positional and keyword arguments alike) and the data ``version``, so
+    responses built from old data are never returned after a reload.
+    Thread-safe; hits and misses are counted per function.
+
+    ## Parametters
+    - ``maxsize``: maximum number of responses kept.
+    - ``ttl``: seconds a response is kept (None: until evicted).
+    - ``version``: function returning the current data version."""
+
+    def __init__(self, maxsize:int = 1024, ttl:float | None = None, version=lambda: None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def key(self, function, *args, **kwargs):
+        """Cache key of ``function`` called with these arguments."""
+        bound = inspect.signature(function).bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = tuple((name, _normalize(value)) for name, value in bound.arguments.items())
+        return (function.__name__, params, self.version())
+
+    def get(self, function, *args, **kwargs):
+        """Returns the ``CachedResponse`` of ``function(*args, **kwargs)``,
+        calling it only on a miss. Exceptions are not cached."""
+        key = self.key(function, *args, **kwargs)
+        name = function.__name__
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.expires is None or entry.expires > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits[name] = self.hits.get(name, 0) + 1
+                return entry
+            self.misses[name] = self.misses.get(name, 0) + 1
+
+        # Computed outside the lock, so slow queries do not block hits
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        entry = CachedResponse(function(*args, **kwargs), expires)
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Size of the cache and hits/misses per function."""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': dict(self.hits),
+                'misses': dict(self.misses)
+            }
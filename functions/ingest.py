@@ -0,0 +1,187 @@
+import os
+import gzip
+import threading
+
+import pandas as pd
+
+import functions.queries as queries
+from functions.ETL import data_paths
+
+# New data files are dropped here. Names start with the dataset they
+# belong to: 'games*.json(.gz)', 'reviews*.csv(.gz)', 'items*.csv(.gz)'
+INBOX_PATH = './data/inbox'
+
+DATASETS = ['games', 'reviews', 'items']
+
+# Only complete files with these extensions are read. Files must be
+# written elsewhere (or under another name, e.g. '.part' or '.tmp') and
+# then renamed into the inbox, so a half written file is never read.
+EXTENSIONS = {
+    'games': ('.json', '.json.gz'),
+    'reviews': ('.csv', '.csv.gz'),
+    'items': ('.csv', '.csv.gz')
+}
+
+DATASET_COLUMNS = {
+    'games': ['item_id', 'developer', 'app_name', 'genres', 'tags', 'specs', 'release_year', 'price'],
+    'reviews': ['user_id', 'item_id', 'recommend', 'sentiment'],
+    'items': ['user_id', 'item_id', 'playtime_forever']
+}
+
+
+def _read_file(path:str):
+    """Private method. Reads a delta file (json lines or csv, optionally gzipped).
+    User ids are always read as strings, as in the datasets (Steam ids
+    are often all digits and would be read as numbers)."""
+    if '.json' in os.path.basename(path):
+        return pd.read_json(path, lines=True, compression='infer', dtype={'user_id': str})
+    return pd.read_csv(path, compression='infer', dtype={'user_id': str})
+
+
+def _id_dtype(name:str):
+    """Private method. dtype of 'item_id' in the dataset being served
+    (the dtype of the categories if it is categorical)."""
+    providers = {'games': queries.games, 'reviews': queries.reviews, 'items': queries.items}
+    dtype = providers[name].get()['item_id'].dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return dtype.categories.dtype
+    return dtype
+
+
+def _prepare(name:str, df:pd.DataFrame):
+    """Private method. Delta rows with the columns of the dataset.
+    Reviews with text and no 'sentiment' are labeled first (labels are
+    added to the sentiment cache, so texts are never scored twice)."""
+    if name == 'reviews' and 'sentiment' not in df.columns:
+        from functions.sentiment import score_texts, SentimentCache
+        cache = SentimentCache()
+        df = df.assign(sentiment=score_texts(df['review'], cache))
+        cache.save()
+
+    # Same item ids as the dataset, so new rows match the existing ones
+    return df[DATASET_COLUMNS[name]].astype({'item_id': _id_dtype(name)})
+
+
+def _persist(name:str, df:pd.DataFrame):
+    """Private method. Appends the rows to the gzip dataset file as a new
+    gzip member (a gzip file can hold many members, read as one stream),
+    so they are loaded again after a restart. Parquet files and the
+    snapshot must be exported again to include them."""
+    path = data_paths(from_main=True, format='gzip')[name]
+    if name == 'games':
+        text = df.to_json(orient='records', lines=True)
+        text += '' if text.endswith('\n') else '\n'
+    else:
+        # Same column order as the header of the file
+        if os.path.exists(path):
+            df = df[pd.read_csv(path, compression='gzip', nrows=0).columns]
+        text = df.to_csv(index=False, header=not os.path.exists(path))
+
+    with open(path, 'ab') as file:
+        file.write(gzip.compress(text.encode('utf-8'), mtime=0))
+
+
+def _move(paths:list[str], folder:str):
+    """Private method. Moves files into ``folder``."""
+    os.makedirs(folder, exist_ok=True)
+    for path in paths:
+        os.replace(path, os.path.join(folder, os.path.basename(path)))
+
+
+def _dataset_of(filename:str):
+    """Private method. Dataset a file of the inbox belongs to, or None if
+    it must not be read (hidden files, other extensions such as '.part'
+    or '.tmp' used while the file is written)."""
+    if filename.startswith('.'):
+        return None
+    for name in DATASETS:
+        if filename.startswith(name) and filename.endswith(EXTENSIONS[name]):
+            return name
+    return None
+
+
+def claim_files(inbox:str = INBOX_PATH):
+    """Moves every new file of the inbox to 'inbox/processing' (so a file
+    is never read twice) and returns ``{dataset: [paths]}``, in order of
+    name. Only files named as in ``EXTENSIONS`` are claimed, so files
+    still being written under a temporary name are left alone."""
+
+    processing = os.path.join(inbox, 'processing')
+    os.makedirs(processing, exist_ok=True)
+
+    claimed = {}
+    for filename in sorted(os.listdir(inbox)):
+        path = os.path.join(inbox, filename)
+        name = _dataset_of(filename)
+        if name is None or not os.path.isfile(path):
+            continue
+        target = os.path.join(processing, filename)
+        os.replace(path, target)
+        claimed.setdefault(name, []).append(target)
+    return claimed
+
+
+def ingest_inbox(inbox:str = INBOX_PATH, persist = True):
+    """Ingests every file found in the ``inbox`` with ``queries.ingest``.
+
+    Processed files are moved to 'inbox/processed' (or 'inbox/failed'
+    if they could not be ingested). With ``persist=True`` the new rows are
+    also appended to the dataset files. Returns the number of new rows
+    per dataset."""
+
+    claimed = claim_files(inbox)
+    if not claimed:
+        return {}
+
+    paths = [path for files in claimed.values() for path in files]
+    try:
+        deltas = {
+            name: pd.concat([_prepare(name, _read_file(path)) for path in files], ignore_index=True)
+            for name, files in claimed.items()
+        }
+        queries.ingest(
+            new_games=deltas.get('games'),
+            new_reviews=deltas.get('reviews'),
+            new_items=deltas.get('items')
+        )
+    except Exception:
+        _move(paths, os.path.join(inbox, 'failed'))
+        raise
+
+    if persist:
+        for name, df in deltas.items():
+            _persist(name, df)
+    _move(paths, os.path.join(inbox, 'processed'))
+
+    counts = {name: len(df) for name, df in deltas.items()}
+    print(f'Inbox ingested: {counts}')
+    return counts
+
+
+class InboxWatcher:
+    """Background thread ingesting the inbox every ``interval`` seconds
+    while the API serves requests. Only one API process should run it."""
+
+    def __init__(self, interval:float = 60, inbox:str = INBOX_PATH, persist = True):
+        self.interval = interval
+        self.inbox = inbox
+        self.persist = persist
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='inbox-watcher', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                ingest_inbox(self.inbox, self.persist)
+            except Exception as error:
+                # A bad file must not stop the watcher
+                print(f'Inbox ingestion failed: {error!r}')
+
+    def start(self):
+        os.makedirs(self.inbox, exist_ok=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
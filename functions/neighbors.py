@@ -0,0 +1,144 @@
+import os
+import hashlib
+import argparse
+import numpy as np
+
+from functions.recomender import CosSimComputer
+
+# Default location of the neighbor index files
+NEIGHBORS_PATH = './data/neighbors'
+
+
+def computer_fingerprint(computer:CosSimComputer):
+    """sha256 of everything deciding the neighbors of the ``computer``
+    besides the item ids: signatures, tie-breaking priority and feature
+    columns. An index is only used with a computer of the same fingerprint."""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(computer.signatureOf, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(computer.priority, dtype=np.int64).tobytes())
+    digest.update('\n'.join(map(str, computer.columns)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def build_neighbor_index(
+        computer:CosSimComputer,
+        k:int = 50,
+        path:str = NEIGHBORS_PATH,
+        batch_size:int = 512
+    ):
+    """Computes the top ``k`` neighbors of every item stored in the
+    ``computer`` and saves them to ``path`` as ``.npy`` files, so they can
+    be memory-mapped later by ``NeighborIndex``.
+
+    Files created:
+        ``item_ids.npy``: item id for every row of the index.
+        ``positions.npy``: (items, k) int32 positions of the neighbors.
+        ``scores.npy``: (items, k) float32 cosine similarities.
+        ``fingerprint.txt``: ``computer_fingerprint`` of the ``computer``.
+
+    ## Parametters:
+    - computer: ``CosSimComputer`` already fitted with the preprocessed games.
+    - k: Number of neighbors kept per item.
+    - path: Folder where files are saved.
+    - batch_size: Number of items scored at once. Each batch is a dense
+    (batch_size, unique vectors) float32 array."""
+
+    matrix = computer.normMatrix
+    n_items = matrix.shape[0]
+    k = min(k, n_items - 1)
+
+    positions = np.empty((n_items, k), dtype=np.int32)
+    scores = np.empty((n_items, k), dtype=np.float32)
+
+    for start in range(0, n_items, batch_size):
+        stop = min(start + batch_size, n_items)
+        # Similarities of the whole batch against every unique vector
+        batch = (matrix[start:stop] @ computer.signatureMatrix.T).toarray()
+
+        for row, sims in enumerate(batch):
+            # Same exclusion and tie-breaking as live scoring
+            top = computer._expand(sims, k, [start + row])
+            positions[start + row] = top
+            scores[start + row] = sims[computer.signatureOf[top]]
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'item_ids.npy'), computer.items['item_id'].to_numpy())
+    np.save(os.path.join(path, 'positions.npy'), positions)
+    np.save(os.path.join(path, 'scores.npy'), scores)
+    with open(os.path.join(path, 'fingerprint.txt'), 'w') as file:
+        file.write(computer_fingerprint(computer))
+
+    print(f'Neighbor index of shape {positions.shape} saved at "{path}"')
+
+
+class NeighborIndex:
+    """Read-only, memory-mapped top ``k`` neighbors of every item,
+    as saved by ``build_neighbor_index``. Rows follow the positions of
+    the items matrix it was built from."""
+
+    def __init__(self, path:str = NEIGHBORS_PATH):
+        self.item_ids = np.load(os.path.join(path, 'item_ids.npy'))
+        self.positions = np.load(os.path.join(path, 'positions.npy'), mmap_mode='r')
+        self.scores = np.load(os.path.join(path, 'scores.npy'), mmap_mode='r')
+        self.k = self.positions.shape[1]
+
+        # Indexes saved without fingerprint are never used
+        fingerprint_path = os.path.join(path, 'fingerprint.txt')
+        self.fingerprint = None
+        if os.path.exists(fingerprint_path):
+            with open(fingerprint_path) as file:
+                self.fingerprint = file.read().strip()
+
+    def n_most_similar(self, n:int, position:int):
+        """Positions of the ``n`` most similar items to the item at
+        ``position`` (see ``CosSimComputer.position``).
+
+        Returns ``None`` when ``n`` is greater than ``k``, so live
+        scoring can be used instead, and no positions when ``n <= 0``."""
+        if n > self.k:
+            return None
+        if n <= 0:
+            return np.array([], dtype=np.intp)
+        return np.asarray(self.positions[position, :n])
+
+
+def load_neighbor_index(computer:CosSimComputer, path:str = NEIGHBORS_PATH):
+    """Loads the ``NeighborIndex`` saved at ``path``.
+
+    Returns ``None`` if there is no index or if it was built for a different
+    catalog than the one stored in ``computer``: other item ids, or other
+    signatures, tie-breaking priority or feature columns (e.g. built with
+    the snapshot and loaded without it), which give another ordering."""
+    if not os.path.exists(os.path.join(path, 'positions.npy')):
+        return None
+
+    index = NeighborIndex(path)
+    if not np.array_equal(index.item_ids, computer.items['item_id'].to_numpy()):
+        print('Neighbor index is outdated, it will not be used.')
+        return None
+    if index.fingerprint != computer_fingerprint(computer):
+        print('Neighbor index was built for another items matrix or tie-breaking, it will not be used.')
+        return None
+
+    print(f'Neighbor index loaded. Top {index.k} neighbors per item.')
+    return index
+
+
+if __name__ == '__main__':
+    from functions.snapshot import (
+        build_computer, fit_preprocessor, load_dataset, load_snapshot, snapshot_exists
+    )
+
+    parser = argparse.ArgumentParser(description='Build the item-item neighbor index.')
+    parser.add_argument('--k', type=int, default=50, help='Neighbors kept per item.')
+    parser.add_argument('--path', default=NEIGHBORS_PATH, help='Output folder.')
+    args = parser.parse_args()
+
+    # Same computer as the API (without a snapshot, ties are broken by
+    # position, see ``queries.computer``), so the fingerprints match
+    if snapshot_exists():
+        computer = load_snapshot()['computer']
+    else:
+        games = load_dataset('games')
+        computer = build_computer(games, fit_preprocessor(games))
+    build_neighbor_index(computer, k=args.k, path=args.path)
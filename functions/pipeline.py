@@ -0,0 +1,292 @@
+import io
+import os
+import gzip
+import time
+import argparse
+import contextlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from functions.ETL import _parse_line, _unpack, extract_years
+
+# Raw files (Steam dataset) and cleaned files written by the pipeline.
+# Same steps as Notebook 1 (Extract and load).
+DATASETS = {
+    'games': {'raw': 'steam_games.json.gz', 'output': 'games.json.gz'},
+    'reviews': {'raw': 'user_reviews.json.gz', 'output': 'user_reviews_c.json.gz'},
+    'items': {'raw': 'users_items.json.gz', 'output': 'items.csv.gz'}
+}
+
+# Nested datasets: column with the array of dictionaries and keys kept
+NESTED = {
+    'reviews': {'where': 'reviews', 'values': ['posted', 'item_id', 'recommend', 'review']},
+    'items': {'where': 'items', 'values': ['item_id', 'playtime_forever']}
+}
+
+GAMES_COLUMNS = ['item_id', 'developer', 'app_name', 'genres', 'tags', 'specs', 'release_year', 'price']
+REVIEWS_COLUMNS = ['user_id', 'item_id', 'recommend', 'review']
+
+
+class StageTimer:
+    """Time of every stage of the pipeline, printed at the end."""
+
+    def __init__(self):
+        self.times = {}
+
+    @contextlib.contextmanager
+    def stage(self, name:str):
+        start = time.perf_counter()
+        yield
+        self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+    def add(self, name:str, seconds:float):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def report(self):
+        for name, seconds in self.times.items():
+            print(f'{name:<32}{seconds:>9.2f} s')
+
+
+# ----------
+# Work done in the worker processes
+
+def _games_chunk(df:pd.DataFrame):
+    """Private method. Row-level cleaning of games (Notebook 1)."""
+    # Empty rows and rows without id are dropped
+    df = df.dropna(axis=0, how='all')
+    if 'id' not in df.columns:
+        return df.iloc[:0]
+    df = df[df['id'].notna()].copy()
+
+    # Only the year of release is kept (nulls filled after merging)
+    df['release_date'] = extract_years(df['release_date'])
+
+    df = df.fillna({
+        'genres': 'Empty',
+        'tags': 'Empty',
+        'specs': 'Empty',
+        'developer': 'Unknown',
+        'app_name': 'Unknown'
+    })
+    return df.rename(columns={'id': 'item_id', 'release_date': 'release_year'})
+
+
+def _nested_chunk(name:str, df:pd.DataFrame, first_row:int):
+    """Private method. Unpacks users' reviews or items. Every unpacked row
+    keeps the number of its raw row (``_row``) so duplicated users can be
+    dropped after merging, exactly as with the whole file."""
+    df = df.assign(_row=np.arange(first_row, first_row + len(df)))
+    users = df[['_row', 'user_id']]
+
+    spec = NESTED[name]
+    unpacked = _unpack(df, spec['where'], spec['values'], ['_row', 'user_id'])
+
+    # Items never played are not kept
+    if name == 'items':
+        unpacked = unpacked[unpacked['playtime_forever'] != 0]
+    return unpacked, users
+
+
+def _process_chunk(name:str, block:bytes, first_row:int):
+    """Private method. Parses a block of raw lines and cleans them.
+    Returns the result and the seconds spent parsing and cleaning."""
+    start = time.perf_counter()
+    records = [_parse_line(line) for line in block.splitlines() if line.strip()]
+    df = pd.DataFrame(records)
+    parsed = time.perf_counter()
+
+    # Per-chunk prints (e.g. extract_years) would flood the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        if name == 'games':
+            result = _games_chunk(df)
+        else:
+            result = _nested_chunk(name, df, first_row)
+
+    return result, parsed - start, time.perf_counter() - parsed
+
+
+def _compress_chunk(df:pd.DataFrame, format:str, header:bool):
+    """Private method. One gzip member with a chunk of the output file.
+    Members are concatenated in order into a single valid gzip file."""
+    if format == 'csv':
+        text = df.to_csv(index=False, header=header)
+    else:
+        text = df.to_json(orient='records', lines=True)
+        if text and not text.endswith('\n'):
+            text += '\n'
+    # No timestamp, so the same data always gives the same bytes
+    return gzip.compress(text.encode('utf-8'), mtime=0)
+
+
+# ----------
+# Pipeline
+
+def _read_blocks(path:str, chunksize:int):
+    """Private method. Raw lines of a gzip file in blocks of ``chunksize``
+    lines, with the number of the first line of each block."""
+    with gzip.open(path, 'rb') as file:
+        lines, first_row = [], 0
+        for line in file:
+            lines.append(line)
+            if len(lines) == chunksize:
+                yield b''.join(lines), first_row
+                first_row += len(lines)
+                lines = []
+        if lines:
+            yield b''.join(lines), first_row
+
+
+def _map_ordered(executor, function, tasks, max_in_flight:int, on_result):
+    """Private method. Runs ``function(*task)`` for every task with at most
+    ``max_in_flight`` tasks submitted and not collected, so only a bounded
+    number of chunks is held in memory. ``on_result`` gets the results in
+    submission order, so merging is deterministic."""
+    if executor is None:
+        for task in tasks:
+            on_result(function(*task))
+        return
+
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= max_in_flight:
+            on_result(pending.popleft().result())
+        pending.append(executor.submit(function, *task))
+    while pending:
+        on_result(pending.popleft().result())
+
+
+def _finalize(name:str, results:list):
+    """Private method. Steps needing the whole dataset: dropping
+    duplicated users (first raw row kept) and filling release years."""
+    if name == 'games':
+        games = pd.concat(results, ignore_index=True)
+        # Null years are filled with the median
+        median_year = games['release_year'].median()
+        games['release_year'] = games['release_year'].fillna(median_year).map(int)
+        return games[[col for col in GAMES_COLUMNS if col in games.columns]]
+
+    unpacked = pd.concat([result[0] for result in results], ignore_index=True)
+    users = pd.concat([result[1] for result in results], ignore_index=True)
+
+    # First raw row of every user; rows of its duplicates are dropped
+    first_rows = users.drop_duplicates('user_id')['_row']
+    df = unpacked[unpacked['_row'].isin(first_rows)].drop(columns='_row').reset_index(drop=True)
+
+    if name == 'reviews':
+        return df[REVIEWS_COLUMNS]
+    return df
+
+
+def run_dataset(
+        name:str,
+        raw_path:str,
+        output_path:str,
+        executor = None,
+        chunksize:int = 20000,
+        max_in_flight:int = 4,
+        timer:StageTimer | None = None
+    ):
+    """Runs the whole ETL of a single dataset: reads the raw gzip file in
+    blocks of lines, parses and cleans every block in the ``executor``,
+    merges the results in order and writes the cleaned file (compressed
+    in parallel, one gzip member per chunk).
+
+    ## Parametters
+    - ``name``: 'games', 'reviews' or 'items'.
+    - ``raw_path``: raw Steam file.
+    - ``output_path``: cleaned file (.json.gz or .csv.gz).
+    - ``executor``: ``ProcessPoolExecutor`` (None runs everything here).
+    - ``chunksize``: raw lines per chunk.
+    - ``max_in_flight``: maximum chunks submitted and not collected.
+    - ``timer``: ``StageTimer`` collecting the time of every stage."""
+
+    timer = timer or StageTimer()
+    results = []
+
+    def collect(result):
+        value, parse_seconds, clean_seconds = result
+        results.append(value)
+        # Summed over every worker
+        timer.add(f'{name}: parse (workers)', parse_seconds)
+        timer.add(f'{name}: clean (workers)', clean_seconds)
+
+    with timer.stage(f'{name}: read + parse + clean'):
+        blocks = ((name, block, first_row) for block, first_row in _read_blocks(raw_path, chunksize))
+        _map_ordered(executor, _process_chunk, blocks, max_in_flight, collect)
+
+    with timer.stage(f'{name}: merge'):
+        df = _finalize(name, results)
+        del results
+
+    with timer.stage(f'{name}: write'):
+        format = 'csv' if output_path.endswith('.csv.gz') else 'json'
+        members = []
+        chunks = (
+            (df.iloc[start:start + chunksize], format, start == 0)
+            for start in range(0, max(len(df), 1), chunksize)
+        )
+        _map_ordered(executor, _compress_chunk, chunks, max_in_flight, members.append)
+
+        # Written next to the output and then renamed, so a failed
+        # run never leaves a half written file
+        temporary = output_path + '.tmp'
+        with open(temporary, 'wb') as file:
+            for member in members:
+                file.write(member)
+        os.replace(temporary, output_path)
+
+    print(f'{name}: {df.shape} saved at "{output_path}"')
+    return df
+
+
+def run_pipeline(
+        raw_dir:str = './raw_data',
+        out_dir:str = './data',
+        datasets:list[str] | None = None,
+        workers:int | None = None,
+        chunksize:int = 20000
+    ):
+    """Runs the ETL of every dataset in ``datasets`` (all by default)
+    with ``workers`` processes (all cores by default; 1 runs in this
+    process) and prints the time of every stage."""
+
+    datasets = datasets or list(DATASETS)
+    workers = workers or os.cpu_count()
+    timer = StageTimer()
+
+    # Pool shared by every dataset
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for name in datasets:
+            run_dataset(
+                name,
+                os.path.join(raw_dir, DATASETS[name]['raw']),
+                os.path.join(out_dir, DATASETS[name]['output']),
+                executor=executor,
+                chunksize=chunksize,
+                # Twice the workers keeps every core busy while reading
+                max_in_flight=2 * workers,
+                timer=timer
+            )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print(f'ETL done with {workers} worker(s):')
+    timer.report()
+    return timer.times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the ETL of the raw Steam files.')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores).')
+    parser.add_argument('--chunksize', type=int, default=20000, help='Raw lines per chunk.')
+    parser.add_argument('--raw', default='./raw_data', help='Folder of the raw files.')
+    parser.add_argument('--out', default='./data', help='Output folder.')
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), default=None, help='Datasets to process.')
+    args = parser.parse_args()
+
+    run_pipeline(args.raw, args.out, args.datasets, args.workers, args.chunksize)
@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np 
 import re
+import json
+from scipy.sparse import csr_matrix
 
 
 # Function to return correct values of prices in column
@@ -36,6 +38,31 @@ def float_prices(value):
             return n
         # Returning zero otherwise because probably the string is 'Free...' or related.
         return 0
+
+
+def clean_prices(prices:pd.Series):
+    """Column-level version of ``float_prices``.
+    
+    Numbers (and numeric strings) are converted at once, and prices
+    inside the remaining strings are caught with a single vectorized
+    ``str.extract``. Strings without a price become zero and null
+    values are kept."""
+
+    # Numbers and numeric strings
+    numeric = pd.to_numeric(prices, errors='coerce')
+
+    # Prices inside the other strings, '[...] $(some digits)'
+    strings = prices.map(lambda p: isinstance(p, str)) & numeric.isna()
+    extracted = (
+        prices[strings]
+        .astype(str)  # So an all-numeric column (no strings) also works
+        .str.extract(r"\B[$](\d*[.]\d*)", expand=False)
+        .astype(float)
+        .fillna(0)  # Probably 'Free...' or related
+    )
+
+    numeric[strings] = extracted
+    return numeric.round(2)
     
 
 def genres_unpacking(df:pd.DataFrame, get_unique = False):
@@ -100,20 +127,32 @@ def specs_unpacking(df:pd.DataFrame, get_unique=False):
 
 # Discretization and Dummies for year segmentation
 
-def _year_binning(y:int):
-    """Private method. It return labels for decades:
-    - Before 2000
-    - Between 2000 and 2010.
-    - After 2010"""
-
-    if y < 2000:
-        return 'Released before 2000'
-    elif y >= 2000 and y < 2010:
-        return 'Released in 2000-2010'
-    else:
-        return 'Released after 2010'
+# Default groups. Labels[0] is for values below edges[0], labels[i] for
+# values in [edges[i-1], edges[i]) and labels[-1] from the last edge.
+YEAR_EDGES = [2000, 2010]
+YEAR_LABELS = ['Released before 2000', 'Released in 2000-2010', 'Released after 2010']
+PRICE_EDGES = [5, 30, 60]
+PRICE_LABELS = ['Very low cost', 'Cheap', 'Typical price', 'Expensive']
+
+
+def _binning(values:pd.Series, edges:list, labels:list[str]):
+    """Private method. Vectorized discretization of a whole column
+    with ``pd.cut`` (intervals closed on the left). Nulls are kept."""
+    return pd.cut(
+        values,
+        bins=[-np.inf, *edges, np.inf],
+        labels=labels,
+        right=False
+    ).astype(object)
+
     
-def year_binning(df:pd.DataFrame, dummies=False, drop_old=False):
+def year_binning(
+        df:pd.DataFrame,
+        dummies=False,
+        drop_old=False,
+        edges:list = YEAR_EDGES,
+        labels:list[str] = YEAR_LABELS
+    ):
     """EXCLUSIVE USAGE FOR games DATASET.
     
     Applies discretization (binning) technique for 
@@ -129,10 +168,13 @@ def year_binning(df:pd.DataFrame, dummies=False, drop_old=False):
     
     - ``drop_old``: Default ``False``. When set to ``True``, it will drop
     the original column for release years and return only the
-    one created after grouping.'"""
+    one created after grouping.'
+    
+    - ``edges`` and ``labels``: Optional. Groups to use, see ``YEAR_EDGES``
+    and ``YEAR_LABELS``."""
     
     # Creating grouped column
-    df['release_period'] = df['release_year'].map(_year_binning, na_action='ignore')
+    df['release_period'] = _binning(df['release_year'], edges, labels)
 
     if drop_old:
         # Dropping years column
@@ -145,18 +187,14 @@ def year_binning(df:pd.DataFrame, dummies=False, drop_old=False):
 
     return None
 
-
-def _price_binning(p:float):
-    if p < 5:
-        return 'Very low cost'
-    elif p >= 5 and p < 30:
-        return 'Cheap'
-    elif p >= 30 and p < 60:
-        return 'Typical price'
-    else:
-        return 'Expensive'
     
-def price_binning(df:pd.DataFrame, dummies=False, drop_old=False):
+def price_binning(
+        df:pd.DataFrame,
+        dummies=False,
+        drop_old=False,
+        edges:list = PRICE_EDGES,
+        labels:list[str] = PRICE_LABELS
+    ):
     """EXCLUSIVE USAGE FOR games DATASET.
     
     Applies discretization (binning) technique for 
@@ -171,10 +209,13 @@ def price_binning(df:pd.DataFrame, dummies=False, drop_old=False):
     
     - ``drop_old``: Default ``False``. When set to ``True``, it will drop
     the original column for prices and return only the the df with the
-    one created after grouping.'"""
+    one created after grouping.'
+    
+    - ``edges`` and ``labels``: Optional. Groups to use, see ``PRICE_EDGES``
+    and ``PRICE_LABELS``."""
 
     # Creating grouped column
-    df['cost'] = df['price'].map(_price_binning, na_action='ignore')
+    df['cost'] = _binning(df['price'], edges, labels)
 
     if drop_old:
         # Dropping years column
@@ -189,69 +230,83 @@ def price_binning(df:pd.DataFrame, dummies=False, drop_old=False):
     return None
 
 
-# Function to get the dummie rows for genre
-def _genres_dummies(list_, unique):
-    """Private method to create dummie rows from a list.
+# Multi-hot encoding for list-valued columns
+def multi_hot(series:pd.Series, vocabulary=None, sparse=False):
+    """Encodes a column of lists (like 'genres' or 'specs') as a
+    multi-hot matrix in a single vectorized pass: one column per label
+    in ``vocabulary``, with ones for the labels found in each row.
+
+    Values that are not lists (e.g. 'Empty') become rows full of zeros.
     
-    An array of unique values should be passed and it will match
-    the position if come item in `unique` is found.
+    ## Parametters
+    - ``vocabulary``: Optional. Labels to encode, in order. Labels not in
+    the vocabulary are ignored, so a saved vocabulary encodes new rows with
+    exactly the same columns. By default every label found, in order of
+    first appearance.
+    - ``sparse``: Default ``False``. If ``True`` returns a ``scipy.sparse``
+    CSR matrix instead of a dense ``uint8`` array.
     
-    Returns a 1-dimensional array full of ones (for mathed items) and
-    zeros (for unmatched items)."""
+    Returns ``(matrix, vocabulary)``."""
 
-    # Creating the dummie row
-    row = np.zeros(len(unique), dtype=int)
+    # One row per (position, label)
+    exploded = (
+        series.map(lambda list_: list_ if isinstance(list_, list) else [])
+        .reset_index(drop=True)
+        .explode()
+        .dropna()
+    )
 
-    # No genre returns row full of zeros
-    if list_ == 'Empty':
-        return row
-    
-    # Loop to check every single genre appearance.
-    for pos, genre in enumerate(unique):
-        if genre in list_:
-            # update row position
-            row[pos] = 1
-    
-    return row
+    if vocabulary is None:
+        vocabulary = exploded.unique()
+    vocabulary = pd.Index(vocabulary)
 
-def genres_dummies(df:pd.DataFrame, drop_old=False):
-    """ This function es exclusively used for getting dummie genres row
-    for the games DataFrame which contains lists stored in tabular data.
-    
-    Set `drop_old = True` to drop the original genres column."""
+    # Column of every label, -1 when not in the vocabulary
+    cols = vocabulary.get_indexer(exploded.to_numpy())
+    known = cols >= 0
+    rows = exploded.index.to_numpy()[known]
+    cols = cols[known]
+
+    shape = (len(series), len(vocabulary))
+    if sparse:
+        matrix = csr_matrix((np.ones(len(rows), dtype=np.uint8), (rows, cols)), shape=shape)
+        # Repeated labels in a row are still a single one
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return matrix, vocabulary
+
+    matrix = np.zeros(shape, dtype=np.uint8)
+    matrix[rows, cols] = 1
+    return matrix, vocabulary
 
-    # Gets unique genres for 
-    unique_genres = genres_unpacking(df, get_unique=True)
+
+def list_dummies(df:pd.DataFrame, column:str, vocabulary=None, drop_old=False):
+    """Concatenates to ``df`` the dummie columns (``multi_hot``) of the
+    list-valued ``column``. A saved ``vocabulary`` can be passed.
+
+    Set `drop_old = True` to drop the original column."""
 
     # Getting dummies
-    dummies = df['genres'].apply(_genres_dummies, unique=unique_genres)
+    matrix, vocabulary = multi_hot(df[column], vocabulary=vocabulary)
 
     # Converting the result matrix to a DataFrame
-    dummies_df = pd.DataFrame(data=dummies.tolist(), columns=unique_genres)
+    dummies_df = pd.DataFrame(data=matrix, columns=vocabulary, index=df.index)
 
     # Concatenating dummies to df
     df = pd.concat([df, dummies_df], axis=1)
 
     if drop_old:
-        df.drop(columns='genres', inplace=True)
+        df.drop(columns=column, inplace=True)
 
     return df
 
 
-# Dummies for specs
-# Function to get dummie rows
-def _specs_dummies(list_, unique):
-    # Creating the dummie row
-    row = np.zeros(len(unique), dtype=int)
-    # No specs returns a row full of zeros
-    if list_ == 'Empty':
-        return row
-    # Loop to check every single genre appearance.
-    for pos, spec in enumerate(unique):
-        if spec in list_:
-            # update row position
-            row[pos] = 1
-    return row
+def genres_dummies(df:pd.DataFrame, drop_old=False):
+    """ This function es exclusively used for getting dummie genres row
+    for the games DataFrame which contains lists stored in tabular data.
+    
+    Set `drop_old = True` to drop the original genres column."""
+
+    return list_dummies(df, 'genres', drop_old=drop_old)
 
 
 def specs_dummies(df:pd.DataFrame, drop_old=False):
@@ -260,48 +315,128 @@ def specs_dummies(df:pd.DataFrame, drop_old=False):
     
     Set `drop_old = True` to drop the original genres column."""
 
-    # Getting unique values for specs
-    unique_specs = specs_unpacking(df, get_unique=True)
-
-    # Getting dummies
-    dummies = df['specs'].apply(_specs_dummies, unique=unique_specs)
+    return list_dummies(df, 'specs', drop_old=drop_old)
+
+# Fitted preprocessing
+class GamesPreprocessor:
+    """Fitted version of ``preprocess_games``.
+
+    ``fit()`` stores everything learned from the games DataFrame: the
+    price median, the bin edges and labels, and the genres and specs
+    vocabularies. ``transform()`` then encodes any games (e.g. only the
+    new ones) with exactly the same columns, in the same order. It can
+    be saved to and loaded from a json file."""
+
+    def __init__(
+            self,
+            year_edges:list = YEAR_EDGES,
+            year_labels:list[str] = YEAR_LABELS,
+            price_edges:list = PRICE_EDGES,
+            price_labels:list[str] = PRICE_LABELS
+        ):
+        self.yearEdges = list(year_edges)
+        self.yearLabels = list(year_labels)
+        self.priceEdges = list(price_edges)
+        self.priceLabels = list(price_labels)
+
+        # Learned by fit()
+        self.priceMedian = None
+        self.periodColumns = None
+        self.costColumns = None
+        self.genresVocabulary = None
+        self.specsVocabulary = None
+
+    @property
+    def featureColumns(self):
+        """Labels of the encoded columns, in order."""
+        return (
+            ['_' + label for label in self.periodColumns]
+            + ['_' + label for label in self.costColumns]
+            + list(self.genresVocabulary)
+            + list(self.specsVocabulary)
+        )
+
+    def fit(self, df:pd.DataFrame):
+        # Cleaning prices to get the median
+        prices = clean_prices(df['price'])
+        self.priceMedian = float(prices.median())
+
+        # Groups found, sorted like pd.get_dummies does
+        periods = _binning(df['release_year'], self.yearEdges, self.yearLabels)
+        costs = _binning(prices.fillna(self.priceMedian), self.priceEdges, self.priceLabels)
+        self.periodColumns = sorted(periods.dropna().unique())
+        self.costColumns = sorted(costs.dropna().unique())
+
+        # Vocabularies in order of first appearance
+        self.genresVocabulary = multi_hot(df['genres'])[1].tolist()
+        self.specsVocabulary = multi_hot(df['specs'])[1].tolist()
+
+        return self
+
+    def transform(self, df:pd.DataFrame):
+        # Working on a copy to avoid modifications on the original
+        df_copy = df.drop(columns='tags', errors='ignore')
+
+        # Cleaning and filling prices
+        prices = clean_prices(df_copy['price']).fillna(self.priceMedian)
+
+        # Year and price binning with the fitted groups
+        binned = pd.DataFrame({
+            'release_period': pd.Categorical(
+                _binning(df_copy['release_year'], self.yearEdges, self.yearLabels),
+                categories=self.periodColumns
+            ),
+            'cost': pd.Categorical(
+                _binning(prices, self.priceEdges, self.priceLabels),
+                categories=self.costColumns
+            )
+        }, index=df_copy.index)
+        dummies = pd.get_dummies(binned, prefix='', dtype=np.uint8)
+
+        df_copy = pd.concat(
+            [df_copy.drop(columns=['release_year', 'price']), dummies],
+            axis=1
+        )
+
+        # Genres and specs dummies with the fitted vocabularies
+        df_copy = list_dummies(df_copy, 'genres', vocabulary=self.genresVocabulary, drop_old=True)
+        df_copy = list_dummies(df_copy, 'specs', vocabulary=self.specsVocabulary, drop_old=True)
+
+        return df_copy
+
+    def fit_transform(self, df:pd.DataFrame):
+        return self.fit(df).transform(df)
+
+    def save(self, path:str):
+        """Saves the fitted preprocessor to a json file."""
+        with open(path, 'w') as file:
+            json.dump(self.__dict__, file)
+        print(f'Preprocessor saved at "{path}"')
+
+    @classmethod
+    def load(cls, path:str):
+        """Loads a preprocessor saved with ``save()``."""
+        with open(path) as file:
+            params = json.load(file)
+
+        preprocessor = cls()
+        preprocessor.__dict__.update(params)
+        return preprocessor
 
-    # Converting the result to a DataFrame
-    dummies_df = pd.DataFrame(data=dummies.tolist(), columns=unique_specs)
-
-    # Concatenating dataFrame
-    df = pd.concat([df, dummies_df], axis=1)
-
-    if drop_old:
-        df.drop(columns='specs', inplace=True)
-    
-    return df
 
 # Complete pipeline
-def preprocess_games(df:pd.DataFrame):
+def preprocess_games(df:pd.DataFrame, preprocessor:GamesPreprocessor | None = None):
     """Applies all preprocessing functions needed to transform the games
     DataFrame into a higher dimensional sparse matrix that can be used
-    to compute similiarities between vectors (which now represent single items)."""
+    to compute similiarities between vectors (which now represent single items).
     
-    df_copy = df.copy()
-    df_copy = df_copy.drop(columns='tags')
-    # Working on a copy to avoid modifications on the original
-
-    # Cleaning and filling prices
-    df_copy['price'] = df_copy['price'].apply(float_prices)
-    df_copy['price'].fillna(df_copy['price'].median(), inplace=True)
-
-    # year binning
-    df_copy = year_binning(df_copy, dummies=True, drop_old=True)
-
-    # Price binning
-    df_copy = price_binning(df_copy, dummies=True, drop_old=True)
+    A fitted ``GamesPreprocessor`` can be passed, otherwise a new one is
+    fitted on ``df``."""
 
-    # Genres dummies
-    df_copy = genres_dummies(df_copy, drop_old=True)
+    if preprocessor is None:
+        preprocessor = GamesPreprocessor().fit(df)
 
-    # Specs dummies
-    df_copy = specs_dummies(df_copy, drop_old=True)
+    df_copy = preprocessor.transform(df)
 
     print('Games data preprocessed. Ready to store in recomender.')
-    return df_copy
\ No newline at end of file
+    return df_copy
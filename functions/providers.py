@@ -0,0 +1,40 @@
+import threading
+
+
+class LazyProvider:
+    """Value built by ``loader`` the first time it is requested.
+
+    ``get()`` is thread-safe: when many threads ask for a value that is not
+    loaded yet, ``loader`` runs only once and every thread gets its result."""
+
+    def __init__(self, loader, name:str | None = None):
+        self.loader = loader
+        self.name = name
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        # Double-checked locking: no lock once the value is loaded
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self.loader()
+                    self._loaded = True
+        return self._value
+
+    def set(self, value):
+        """Replaces the value (e.g. after reloading data)."""
+        with self._lock:
+            self._value = value
+            self._loaded = True
+
+    def reset(self):
+        """Forgets the value, it will be loaded again on next use."""
+        with self._lock:
+            self._value = None
+            self._loaded = False
@@ -1,42 +1,263 @@
+import threading
+from typing import NamedTuple
+
 import pandas as pd
 import numpy as np
 
-from functions.ETL import load_dfs
+from functions import snapshot as snap
+from functions.providers import LazyProvider
+from functions.neighbors import load_neighbor_index, NeighborIndex
+from functions.ann import LSHIndex
+from functions.recomender import CosSimComputer
+from functions.preprocessing import preprocess_games
+from functions.ETL import append_rows
+from functions.aggregates import (
+    genre_playtime_tables, review_year_tables, DeveloperSentimentIndex, UserLibraries,
+    update_genre_tables, update_review_tables
+)
 
-games, reviews, items = load_dfs(from_main=True)
-items = items[:100000]    # Reduced size of items due to memory limitations
+# ----------
+# DATA PROVIDERS
+# Every piece of data is loaded (or built) on first use, so each endpoint
+# only pays for its own dependencies. The snapshot is used when it exists,
+# otherwise everything is built from the datasets.
+
+use_snapshot = snap.snapshot_exists()
+
+manifest = LazyProvider(lambda: snap.read_manifest() if use_snapshot else None, 'manifest')
+
+
+def _from_snapshot(load, build):
+    """Private method. Loader reading from the snapshot or building."""
+    def loader():
+        if use_snapshot:
+            return load(manifest.get())
+        return build()
+    return loader
+
+
+def _table(name:str, build):
+    """Private method. Provider of a precomputed table."""
+    load = lambda manifest_: snap.load_snapshot_table(manifest_, name)
+    return LazyProvider(_from_snapshot(load, build), name)
+
+
+# Datasets (only read when a table must be built from them)
+games = LazyProvider(
+    _from_snapshot(snap.load_snapshot_games, lambda: snap.load_dataset('games')), 'games'
+)
+reviews = LazyProvider(lambda: snap.load_dataset('reviews'), 'reviews')
+items = LazyProvider(lambda: snap.load_dataset('items'), 'items')
+
+# Recommender
+preprocessor = LazyProvider(
+    _from_snapshot(snap.load_snapshot_preprocessor, lambda: snap.fit_preprocessor(games.get())),
+    'preprocessor'
+)
+# Ties are broken by popularity when the snapshot is built (it needs the
+# whole items table). Without a snapshot they are broken by position, so
+# the recommender never loads items.
+computer = LazyProvider(
+    _from_snapshot(
+        lambda manifest_: snap.load_snapshot_computer(manifest_, games.get()),
+        lambda: snap.build_computer(games.get(), preprocessor.get())
+    ),
+    'computer'
+)
+# Precomputed neighbors (built offline with `python -m functions.neighbors`).
+# None when the index has not been built for the current catalog.
+neighbors = LazyProvider(lambda: load_neighbor_index(computer.get()), 'neighbors')
+
+# Columns of games returned by the recommender
+RESPONSE_COLUMNS = ['app_name', 'genres', 'specs', 'release_year', 'price']
+
+
+class Recommender(NamedTuple):
+    """Everything the recommender endpoints need, built for the same
+    catalog and swapped together, so a request never mixes two versions."""
+    computer: CosSimComputer
+    # Games metadata in the same order as the items matrix, so responses are
+    # built by position (``iloc``) with the positions returned by the computer
+    metadata: pd.DataFrame
+    neighbors: NeighborIndex | None
+
+
+def _metadata(games_:pd.DataFrame, computer_:CosSimComputer):
+    """Private method. Response columns of games in items matrix order."""
+    return games_.loc[computer_.index, RESPONSE_COLUMNS].reset_index(drop=True)
+
+recommender = LazyProvider(
+    lambda: Recommender(computer.get(), _metadata(games.get(), computer.get()), neighbors.get()),
+    'recommender'
+)
+
+
+def _build_ann():
+    """Private method. Approximate index, set into the computer."""
+    computer_ = computer.get()
+    index = LSHIndex(computer_.normMatrix)
+    computer_.set_ann(index)
+    return index
+
+# Approximate nearest neighbors index (only built if requested)
+ann = LazyProvider(_build_ann, 'ann')
+
+# Precomputed tables for every endpoint
+genre_tables = _table('genre_tables', lambda: genre_playtime_tables(games.get(), items.get()))
+review_tables = _table('review_tables', lambda: review_year_tables(games.get(), reviews.get()))
+developer_index = _table('developer_index', lambda: DeveloperSentimentIndex(games.get(), reviews.get()))
+libraries = _table('libraries', lambda: UserLibraries(items.get()))
+
+# Providers used by each endpoint
+ENDPOINT_PROVIDERS = {
+    'PlayTimeGenre': [genre_tables],
+    'UserForGenre': [genre_tables],
+    'UsersRecommend': [review_tables],
+    'UsersWorstDeveloper': [review_tables],
+    'sentiment_analysis': [developer_index],
+    'game_recommend': [recommender],
+    'game_recommend_batch': [recommender, libraries]
+}
+
+
+def warmup(endpoints:list[str] | None = None):
+    """Loads everything needed by ``endpoints`` (all by default)
+    before the first request. Unknown names raise ``ValueError``
+    before anything is loaded."""
+    endpoints = endpoints or list(ENDPOINT_PROVIDERS)
+    unknown = [endpoint for endpoint in endpoints if endpoint not in ENDPOINT_PROVIDERS]
+    if unknown:
+        raise ValueError(
+            f'Unknown endpoints to warm up: {", ".join(unknown)}. '
+            f'Valid names: {", ".join(ENDPOINT_PROVIDERS)}'
+        )
+    for endpoint in endpoints:
+        for provider in ENDPOINT_PROVIDERS[endpoint]:
+            provider.get()
+    print(f'Warm up done for: {", ".join(endpoints)}')
+
+
+def version():
+    """Snapshot version (None when built from the datasets)."""
+    manifest_ = manifest.get()
+    return manifest_['version'] if manifest_ is not None else None
+
+
+# Increased every time data is replaced while the API is running
+_generation = 0
+
+
+def data_version():
+    """Version of the data answering the queries: the snapshot version
+    (or 'datasets') and the number of reloads and ingestions. Used as cache key."""
+    return f"{version() or 'datasets'}.{_generation}"
+
+
+# Only one thread replaces data at a time
+_ingest_lock = threading.Lock()
+
+
+def set_reviews(new_reviews:pd.DataFrame):
+    """Replaces the ``reviews`` dataset and rebuilds every
+    table that depends on it."""
+    global _generation
+    with _ingest_lock:
+        review_tables_ = review_year_tables(games.get(), new_reviews)
+        developer_index_ = DeveloperSentimentIndex(games.get(), new_reviews)
+
+        reviews.set(new_reviews)
+        review_tables.set(review_tables_)
+        developer_index.set(developer_index_)
+        _generation += 1
+
+
+def ingest(
+        new_games:pd.DataFrame | None = None,
+        new_reviews:pd.DataFrame | None = None,
+        new_items:pd.DataFrame | None = None
+    ):
+    """Adds new games, reviews and items (same columns as the datasets)
+    while requests keep being served.
+
+    Every affected table is updated from the new rows only (see
+    ``functions.aggregates``) and new games are appended to a copy of the
+    items matrix. Nothing being served is modified: the new values are
+    built first and then swapped in, and cached responses are invalidated."""
+    global _generation
+
+    with _ingest_lock:
+        games_, reviews_, items_ = games.get(), None, None
+        swaps = {}
+
+        # New games: appended to games and to a copy of the items matrix
+        if new_games is not None and len(new_games):
+            start = games_.index.max() + 1
+            new_games = new_games.set_axis(pd.RangeIndex(start, start + len(new_games)))
+            games_ = append_rows(games_, new_games, ignore_index=False)
+
+            computer_ = computer.get().extended(preprocess_games(new_games, preprocessor.get()))
+            swaps[games] = games_
+            swaps[computer] = computer_
+            # Precomputed neighbors are outdated, live scoring is used
+            swaps[neighbors] = None
+            swaps[recommender] = Recommender(computer_, _metadata(games_, computer_), None)
+
+            # Rows already stored for the new games count from now on
+            new_ids = new_games['item_id']
+            reviews_delta = reviews.get().loc[reviews.get()['item_id'].isin(new_ids)]
+            items_delta = items.get().loc[items.get()['item_id'].isin(new_ids)]
+        else:
+            reviews_delta = reviews.get().iloc[:0]
+            items_delta = items.get().iloc[:0]
+
+        if new_reviews is not None and len(new_reviews):
+            reviews_ = append_rows(reviews.get(), new_reviews)
+            swaps[reviews] = reviews_
+            reviews_delta = pd.concat([reviews_delta, new_reviews[reviews_.columns]])
+
+        if new_items is not None and len(new_items):
+            items_ = append_rows(items.get(), new_items)
+            swaps[items] = items_
+            items_delta = pd.concat([items_delta, new_items[items_.columns]])
+            swaps[libraries] = UserLibraries(items_)
+
+        if len(reviews_delta):
+            swaps[review_tables] = update_review_tables(
+                review_tables.get(), games_, reviews_ if reviews_ is not None else reviews.get(),
+                reviews_delta['item_id'].unique()
+            )
+            swaps[developer_index] = developer_index.get().updated(games_, reviews_delta)
+
+        if len(items_delta):
+            swaps[genre_tables] = update_genre_tables(
+                genre_tables.get(), games_, items_delta, items_ if items_ is not None else items.get()
+            )
+
+        # Swapping every value, then invalidating cached responses
+        for provider, value in swaps.items():
+            provider.set(value)
+        if computer in swaps:
+            ann.reset()
+        _generation += 1
+
+    print(f'Ingested: {", ".join(provider.name for provider in swaps)}')
 
 # ----------
 # QUERY ENDPOINTS for API
 
+class UnknownGenreError(KeyError):
+    """The genre has no playtime (answered with 404 by the API)."""
+
 def PlayTimeGenre(genre:str):
     """Return year with the highest number of 
-    hours played for the provided ``genre``"""
-
-    # Merged dataframe with release years and playtime
-    merged = (
-        items[['item_id', 'playtime_forever']]
-        .merge(games[['item_id', 'app_name', 'genres', 'release_year']], 
-               how='left',
-               on='item_id')    # Joining on item_id
-    )
-
-    # Mask to filter out genres
-    mask = (
-        merged['genres']
-        .map(lambda genres: genre in genres, na_action='ignore') # True when genre is found in the list, ignore null
-        .fillna(False)                                           # Nulls should be False, so fill Na with False
-    )
-
-    # Filtering using mask, grouping and aggregate sum
-    year = (
-        merged[mask]
-        .groupby(by='release_year') # Group by year
-        .sum(numeric_only=True) # Aggregated sum by year
-        ['playtime_forever'] #Selecting playtime
-        .idxmax() # Getting the index for the maximum 
-                  # which is now the year after grouping
-    )
+    hours played for the provided ``genre``.
+    Raises `UnknownGenreError` if there is no such genre."""
+
+    # Looking up the precomputed year
+    years = genre_tables.get()['top_year']
+    if genre not in years:
+        raise UnknownGenreError(genre)
+    year = years[genre]
 
     response = {f"Release year with highest playtime for '{genre}' genre": int(year)}
     
@@ -46,47 +267,24 @@ def PlayTimeGenre(genre:str):
 
 def UserForGenre(genre: str):
     """Returns the user with the most hours played
-    given the ``genre``."""
-
-    # Merged DataFrame with user id, playtime
-    # And genres for each item they've played
-    merged = (
-        items
-        .merge(games[['item_id', 'genres', 'release_year']], 
-               how='left',
-               on='item_id')    # Joining on item_id
-    )
-
-    # Mask for filtering
-    mask = (merged['genres']
-        .map(lambda genres: genre in genres, na_action='ignore')    # True when genre is found in the list, ignore null
-        .fillna(False)                                              # Nulls should be False, so fill Na with False
-    )
-
-    # Filtering genres out, grouping by user and 
-    # aggregating sum for playtime
-    user = (
-        merged[mask][['user_id', 'playtime_forever']]
-        .groupby('user_id')
-        .sum()
-        # Sorting in descending order
-        .sort_values(by='playtime_forever', ascending=False)
-    ).iloc[0].name # Name of first record which is the user's id
-
-    # Sum of hours played per year in a list
-    years_played = (
-        merged[mask][['user_id', 'release_year', 'playtime_forever']]
-        .groupby(['user_id', 'release_year'])
-        .sum()
-        .loc[user]
-    ) # This is a list with indexes as years and
-      # values as the sum of hours played
+    given the ``genre``.
+    Raises `UnknownGenreError` if there is no such genre."""
+
+    # Looking up the precomputed user
+    tables = genre_tables.get()
+    if genre not in tables['top_user']:
+        raise UnknownGenreError(genre)
+    user = tables['top_user'][genre]
+
+    # Sum of hours played per year by that user. This is a Series
+    # with indexes as years and values as the sum of hours played
+    years_played = tables['top_user_years'][genre]
 
     # Creating the response
     response = {
         f"User with most hours played for '{genre}'": user,
         "Playtime_year": [
-            f"Year {int(idx)}: {years_played.loc[idx, 'playtime_forever']}" for idx in years_played.index
+            f"Year {int(idx)}: {years_played.loc[idx]}" for idx in years_played.index
         ]   # String formatting in list comprehension
     }
     
@@ -98,28 +296,12 @@ def UsersRecommend(year: int):
     """Top 3 of most recommended games for the 
     given ``year``."""
 
-    # Merged DataFrame already filtered by recommendations and positive/neutral
-    # reviews
-    merged = (
-        reviews.loc[(reviews['recommend'] == True) & (reviews['sentiment'] > 0)]
-        .merge(games[['item_id', 'app_name', 'release_year']], 
-               how='left', 
-               on='item_id')
-    )
-
-    # Filtering by the year given
-    masked = merged[merged['release_year'] == year]
-
-    # Getting titles of games
-    titles = (
-        masked[['app_name', 'sentiment']]               # Selecting 
-        .groupby('app_name').sum()                      # Grouping by sum(app_name)
-        .sort_values(by='sentiment', ascending=False)   # Sorting in descending order
-    )[:3].index                                         # Getting the top 3 indexes (now the names)
+    # Looking up the precomputed titles
+    titles = review_tables.get()['recommended'].get(year, ())
 
     # Dict comprehension to create the response
     response = {
-        f"Top {i+1}": titles[i] for i in range(3)
+        f"Top {i+1}": title for i, title in enumerate(titles)
         }
     
     return response
@@ -135,82 +317,117 @@ def UsersWorstDeveloper(year: int):
     each developer in an already-filtered
     DataFrame containing only negative reviews."""
 
-    # Merged DataFrame already filtered by recommendations and negative reviews
-    merged = (
-    reviews.loc[(reviews['recommend'] == False) & (reviews['sentiment'] == 0)]
-    .merge(games[['item_id', 'release_year', 'developer']],
-           how='left',
-           on='item_id')
-    )
-
-    # Filtering by the year given
-    masked = merged[merged['release_year'] == year]
-
-    # Getting titles
-    titles = masked['developer'].value_counts()[:3].index
+    # Looking up the precomputed developers
+    titles = review_tables.get()['worst_developers'].get(year, ())
 
     # Creating json-like response
     response = {
-        f"Top worst dev {i+1}": titles[i] for i in range(3)
+        f"Top worst dev {i+1}": title for i, title in enumerate(titles)
         }
 
     return response
 
 # ---------
 
-def sentiment_analysis(dev: str):
+def sentiment_analysis(dev: str, match: str = 'exact'):
     """Returns a dictionary containing
     the count for each review category.
     
     Negative: sentiment = 0 
     Neutral: sentiment = 1
     Positive: sentiment = 2
-    """
-    # Merged DataFrame
-    merged = (
-        reviews
-        .merge(games[['item_id', 'release_year', 'developer']], how='left', on='item_id')
-    )
 
-    # Filtering developers
-    masked = merged[merged['developer'] == dev]
+    ``match`` can be 'exact', 'insensitive' or 'prefix'
+    to look for the developer name.
+    """
+    # Looking up the precomputed counts
+    counts = developer_index.get().lookup(dev, match=match)
 
     # Labels to assign
-    labels = ['Negative', 'Neutral', 'Positive']
-    # Counting and not sorting as indexes need to be ordered
-    # to match labels
-    revs_count = masked.value_counts('sentiment', sort=False)
+    labels = DeveloperSentimentIndex.labels
 
-    # Building the response json  usind dict comprehension
+    # Building the response json usind dict comprehension
     response = {
-        dev: [f"{label} = {value}" for (label, value) in zip(labels, revs_count)]
+        name: [f"{label} = {value}" for (label, value) in zip(labels, values)]
+        for name, values in counts.items()
         }
+
+    # Keeping the same shape for developers not found
+    if not response:
+        response = {dev: []}
     return response
 
 # ----------
-# Preproces data and Fit Computer class
-from functions.recomender import CosSimComputer
-from functions.preprocessing import preprocess_games
-
-# Applying preprocessing
-df = preprocess_games(games)
-df = df.iloc[:10000] 
+# Recommender
 
-# Instance computer feeding it with the processed dataset
-computer = CosSimComputer(df)
+class UnknownItemError(KeyError):
+    """The item id is not in the catalog (answered with 404 by the API)."""
 
-def game_recommend(n_sim:int, to_id:int):
+def game_recommend(n_sim:int, to_id:int, approximate:bool = False):
     """Takes `n_sim` integer, `to_id` id integer and pass it into
-    the `n_most_similar()` method of `CosSimComputer` class object
-    previously instantiated."""
-
-    # Getting the n_sim most similar to to_id
-    similars_idx = computer.n_most_similar(n=n_sim, to_=to_id, indexes=True)
+    the `top_similar()` method of `CosSimComputer` class object
+    previously instantiated.
     
-    # Getting items from the original dataset using indexes
-    items = games.loc[similars_idx, ['app_name', 'genres', 'specs', 'release_year', 'price']]
+    With `approximate=True` the approximate index is used when
+    the answer is not in the precomputed neighbors. Raises
+    `UnknownItemError` if `to_id` is not in the catalog."""
+
+    # Computer, metadata and neighbors of the same catalog
+    computer_, metadata_, neighbors_ = recommender.get()
+    if approximate:
+        ann.get()
+
+    # Position of the item, shared by the matrix, neighbors and metadata
+    position = computer_.position(to_id)
+    if position is None:
+        raise UnknownItemError(to_id)
+
+    # Looking up the precomputed neighbors first
+    similars_pos = None
+    if neighbors_ is not None:
+        similars_pos = neighbors_.n_most_similar(n=n_sim, position=position)
+
+    if similars_pos is None:
+        # Getting the n_sim most similar to to_id
+        similars_pos = computer_.top_similar(
+            computer_.query_vector(position), n_sim, exclude=[position], approximate=approximate
+            )
     
-    # Creating the json response
-    response = items.to_dict(orient='records')
+    # Getting items metadata by position and creating the json response
+    response = metadata_.iloc[similars_pos].to_dict(orient='records')
+
+    return response
+
+def game_recommend_batch(
+        n_sim:int,
+        to_ids:list[int] | None = None,
+        user_id:str | None = None,
+        merge:bool = False
+    ):
+    """Recommendations for many items in one call, passing them into the
+    `top_similar_batch()` method of `CosSimComputer`.
+
+    Items in the library of `user_id` (from `items`) are added to `to_ids`.
+    Unknown ids are skipped. With `merge=True` a single deduplicated ranking
+    is returned instead of one list of recommendations per item."""
 
-    return response
\ No newline at end of file
+    to_ids = list(to_ids or [])
+    if user_id is not None:
+        to_ids += libraries.get().get(user_id).tolist()
+
+    computer_, metadata_, _ = recommender.get()
+
+    # Positions of the ids found (repeated ids only once)
+    found = {id: computer_.position(id) for id in dict.fromkeys(to_ids)}
+    found = {id: position for id, position in found.items() if position is not None}
+    similars = computer_.top_similar_batch(list(found.values()), n_sim, merge=merge)
+
+    # Single ranking
+    if merge:
+        return metadata_.iloc[similars].to_dict(orient='records')
+
+    # Creating the json response, one list per item id
+    response = {
+        str(id): metadata_.iloc[pos].to_dict(orient='records') for id, pos in zip(found, similars)
+    }
+    return response
@@ -1,63 +1,302 @@
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from sklearn.preprocessing import normalize
 
 class CosSimComputer:
 
-    def __init__(self, df:pd.DataFrame):
-        self.df = df
-        self.itemsMatrix = df.loc[:,'_Released after 2010':]
+    def __init__(self, df:pd.DataFrame, columns:list[str] | None = None):
+        # Feature columns given by the preprocessor, or every column
+        # from the first dummie of release periods
+        if columns is not None:
+            features = df[columns]
+        else:
+            features = df.loc[:,'_Released after 2010':]
+
+        # Column vocabulary: label of every feature in the items matrix
+        self.columns = features.columns
+        # Almost every cell is zero, so only non zero values are stored
+        self.itemsMatrix = sparse.csr_matrix(features.to_numpy(), dtype=np.float32)
         self.items = df.loc[:,['item_id', 'app_name']]
-        self.basisVector = None
-        self.basisVector_index = None
-
-        print(f'Cosine Similarity Computer adjusted Dataframe of shape: {self.df.shape}')
-        print(f'Items Matrix Shape: {self.itemsMatrix.shape}')
-
-    def set_basisVector(self, id):
-        # Creating vector with the corect shape
-        vector_idx = self.df.loc[self.df['item_id'] == id].index
-
-        # Getting values of the resulting Series
-        vector = self.itemsMatrix.iloc[vector_idx].values
-        
-        # Instance basis vector and its index
-        self.basisVector = vector.reshape(1,-1)
-        self.basisVector_index = vector_idx
-
-    def _cos_sim(self, item:pd.Series):
-        cos_sim = cosine_similarity(
-            self.basisVector, item.values.reshape(1,-1)
-            )[0,0]
-        return cos_sim
-    
-    def compute_similarities(self):
-        similarities = (
-            # Dropping basisVector temporally to avoid computing the
-            # similiarity to itself
-            self.itemsMatrix.drop(index=self.basisVector_index)
-            .apply(
-                lambda row: self._cos_sim(item=row), 
-                axis=1
-                )
-            )
-        return similarities
-    
-    def n_most_similar(self, n:int, to_:int, indexes = False):
+        self.index = df.index
+        # Optional approximate nearest neighbors index
+        self.ann = None
+
+        # L2-normalized copy of the items matrix (still CSR), built once.
+        # Cosine similarity against every item is then a single
+        # matrix-vector product (rows full of zeros stay as zeros).
+        self.normMatrix = normalize(self.itemsMatrix, norm='l2')
+
+        # Identical feature vectors are scored only once
+        self.set_signatures(*self._find_signatures(self.itemsMatrix))
+        self._build_positions()
+
+        print(f'Cosine Similarity Computer adjusted Dataframe of shape: {df.shape}')
+        print(f'Items Matrix Shape: {self.itemsMatrix.shape} ({self.itemsMatrix.nnz} non zero values)')
+        print(f'Unique feature vectors: {self.signatureMatrix.shape[0]}')
+
+    @classmethod
+    def from_matrices(
+            cls,
+            itemsMatrix:sparse.csr_matrix,
+            normMatrix:sparse.csr_matrix,
+            items:pd.DataFrame,
+            columns:list[str],
+            index:pd.Index,
+            signatureOf:np.ndarray,
+            representatives:np.ndarray,
+            priority:np.ndarray
+        ):
+        """Creates a computer from matrices and signatures already built
+        (e.g. loaded from a snapshot), without preprocessing anything."""
+        computer = cls.__new__(cls)
+        computer.columns = pd.Index(columns)
+        computer.itemsMatrix = itemsMatrix
+        computer.normMatrix = normMatrix
+        computer.items = items
+        computer.index = index
+        computer.ann = None
+        computer.set_signatures(signatureOf, representatives, priority)
+        computer._build_positions()
+        return computer
+
+    def _build_positions(self):
+        """Private method. item id -> position in the items matrix (first
+        match if the id is repeated), so ids are found without scanning."""
+        ids, positions = np.unique(self.items['item_id'].to_numpy(), return_index=True)
+        self.itemPositions = dict(zip(ids.tolist(), positions.tolist()))
+
+    def extended(self, df:pd.DataFrame):
+        """New computer with the preprocessed games in ``df`` appended
+        (encoded with the same ``columns``). New items go last when
+        breaking ties. This computer is not changed, so it can keep
+        serving requests until the new one is swapped in."""
+        newMatrix = sparse.csr_matrix(df[self.columns].to_numpy(), dtype=np.float32)
+        itemsMatrix = sparse.vstack([self.itemsMatrix, newMatrix], format='csr')
+        signatureOf, representatives = self._find_signatures(itemsMatrix)
+        n_items = self.itemsMatrix.shape[0]
+
+        return self.from_matrices(
+            itemsMatrix=itemsMatrix,
+            normMatrix=sparse.vstack([self.normMatrix, normalize(newMatrix, norm='l2')], format='csr'),
+            items=pd.concat([self.items, df.loc[:, ['item_id', 'app_name']]]),
+            columns=self.columns,
+            index=self.index.append(df.index),
+            signatureOf=signatureOf,
+            representatives=representatives,
+            priority=np.append(self.priority, np.arange(n_items, itemsMatrix.shape[0]))
+        )
+
+    @staticmethod
+    def _find_signatures(matrix:sparse.csr_matrix):
+        """Private method. Signature (unique feature vector) of every item,
+        numbered in order of first appearance, and the position of the first
+        item of each signature."""
+        matrix.sort_indices()
+
+        # Every row as bytes: its non zero columns and values
+        keys = [
+            matrix.indices[start:stop].tobytes() + matrix.data[start:stop].tobytes()
+            for start, stop in zip(matrix.indptr[:-1], matrix.indptr[1:])
+        ]
+        signatureOf, _ = pd.factorize(pd.Series(keys, dtype=object))
+        representatives = np.unique(signatureOf, return_index=True)[1]
+        return signatureOf, representatives
+
+    def set_signatures(self, signatureOf:np.ndarray, representatives:np.ndarray, priority:np.ndarray | None = None):
+        """Sets the signature of every item and the tie-breaking priority
+        (lower goes first, by default the position of the item).
+
+        Only the unique vectors (``signatureMatrix``) are scored. Items of
+        each signature are stored together, sorted by priority, to expand
+        the ranked signatures back to items."""
+        n_items = self.normMatrix.shape[0]
+        self.signatureOf = np.asarray(signatureOf)
+        self.representatives = np.asarray(representatives)
+        self.priority = np.arange(n_items) if priority is None else np.asarray(priority)
+
+        self.signatureMatrix = self.normMatrix[self.representatives]
+
+        # Items grouped by signature, sorted by priority inside every group
+        self.signatureItems = np.lexsort((self.priority, self.signatureOf))
+        self.signatureStarts = np.searchsorted(
+            self.signatureOf[self.signatureItems], np.arange(len(self.representatives) + 1)
+        )
+
+    def set_popularity(self, popularity:np.ndarray):
+        """Ties are broken by ``popularity`` (one value per item, the
+        highest goes first) and then by position."""
+        order = np.lexsort((np.arange(len(popularity)), -np.asarray(popularity)))
+        priority = np.empty(len(order), dtype=np.intp)
+        priority[order] = np.arange(len(order))
+        self.set_signatures(self.signatureOf, self.representatives, priority)
+
+    def set_ann(self, ann):
+        """Sets the approximate nearest neighbors index (e.g.
+        ``functions.ann.LSHIndex``) used when ``approximate=True``."""
+        self.ann = ann
+
+    def position(self, id):
+        """Position of the item ``id`` in the items matrix (first match if
+        the id is repeated), or None if it is unknown."""
+        return self.itemPositions.get(id)
+
+    def query_vector(self, position:int):
+        """Normalized row of the item at ``position`` as a dense vector."""
+        return self.normMatrix[position].toarray().reshape(-1)
+
+    def _signature_scores(self, vector:np.ndarray):
+        """Private method. Cosine similarity of every unique vector to
+        ``vector`` (already normalized)."""
+        return self.signatureMatrix @ vector
+
+    def _rank(self, positions:np.ndarray, scores:np.ndarray, n:int):
+        """Private method. The ``n`` best ``positions`` by score, ties
+        broken by priority."""
+        order = np.lexsort((self.priority[positions], -scores))
+        return positions[order[:n]]
+
+    def _expand(self, signature_scores:np.ndarray, n:int, exclude:np.ndarray):
+        """Private method. Positions of the ``n`` most similar items given
+        the scores of the signatures, never returning ``exclude``.
+
+        Signatures are ranked and only the best ones holding at least ``n``
+        items (plus every signature tied with the last one) are expanded."""
+        exclude = np.asarray(exclude, dtype=np.intp)
+        n = min(n, len(self.signatureOf) - len(np.unique(exclude)))
+        if n <= 0:
+            return np.array([], dtype=np.intp)
 
-        # Re instancing basis vector for each compute
-        self.set_basisVector(to_)
+        # Items available in every signature
+        available = np.diff(self.signatureStarts)
+        np.subtract.at(available, self.signatureOf[exclude], 1)
 
-        # Computing similars
-        similars = self.compute_similarities()
+        # Score of the last signature needed to get n items
+        order = np.argsort(-signature_scores, kind='stable')
+        last = np.searchsorted(np.cumsum(available[order]), n)
+        threshold = signature_scores[order[min(last, len(order) - 1)]]
 
-        # indexes for n largest excluding itself
-        n_largest = similars.nlargest(n).index
+        chosen = np.flatnonzero(signature_scores >= threshold)
+        positions = np.concatenate([
+            self.signatureItems[self.signatureStarts[sig]:self.signatureStarts[sig + 1]]
+            for sig in chosen
+        ])
+        positions = positions[~np.isin(positions, exclude)]
+
+        return self._rank(positions, signature_scores[self.signatureOf[positions]], n)
+
+    def _approximate_top_n(self, vector:np.ndarray, n:int, exclude:np.ndarray):
+        """Private method. Like ``top_similar`` but scoring only the
+        candidates given by the approximate index. Falls back to exact
+        scoring when there are not enough candidates."""
+        candidates = self.ann.candidates(vector)
+        candidates = candidates[~np.isin(candidates, exclude)]
+        if len(candidates) < n:
+            return self._expand(self._signature_scores(vector), n, exclude)
+
+        scores = self.normMatrix[candidates] @ vector
+        return self._rank(candidates, scores, n)
+
+    def top_similar(self, vector:np.ndarray, n:int, exclude = (), approximate = False):
+        """Positions of the ``n`` items most similar to ``vector`` (already
+        normalized), never returning the positions in ``exclude``.
+
+        Stateless: nothing is stored in the instance, so it can be called
+        from many threads at once (sparse products and sorts run in
+        NumPy/SciPy code releasing the GIL)."""
+        exclude = np.asarray(exclude, dtype=np.intp)
+        if approximate and self.ann is not None:
+            return self._approximate_top_n(vector, n, exclude)
+        return self._expand(self._signature_scores(vector), n, exclude)
+
+    def compute_similarities(self, to_:int):
+        """Cosine similarity of every item to the id ``to_``
+        as a Series (the item itself is not included)."""
+        position = self.position(to_)
+        if position is None:
+            return pd.Series(dtype=np.float32)
+
+        scores = self._signature_scores(self.query_vector(position))[self.signatureOf]
+        similarities = pd.Series(scores, index=self.index)
+        # Dropping the item to avoid returning the similarity to itself
+        return similarities.drop(index=self.index[[position]])
+
+    def n_most_similar(self, n:int, to_:int, indexes = False, approximate = False):
+
+        # Query vector for this call only (unknown ids give no results)
+        position = self.position(to_)
+        if position is None:
+            n_largest = np.array([], dtype=np.intp)
+        else:
+            # positions for n largest excluding itself
+            n_largest = self.top_similar(
+                self.query_vector(position), n, exclude=[position], approximate=approximate
+                )
 
         # Choosing to return the indexes
         if indexes:
-            return n_largest
-        
+            return self.index[n_largest]
+
         # Returning items id and names
         items = self.items.iloc[n_largest]
-        return items
\ No newline at end of file
+        return items
+
+    def top_similar_batch(self, positions:np.ndarray, n:int, merge = False, block:int = 256):
+        """Like ``top_similar`` for the items at ``positions``, scored with
+        matrix-matrix products of ``block`` queries at a time (so memory does
+        not grow with the number of queries). Returns a list of positions per
+        item or, when ``merge=True``, one deduplicated ranking where every item
+        gets its best similarity to any of them (they are never returned)."""
+
+        positions = np.asarray(positions, dtype=np.intp)
+        if merge and not len(positions):
+            return np.array([], dtype=np.intp)
+
+        best = None
+        similars = []
+        for start in range(0, len(positions), block):
+            chunk = positions[start:start + block]
+            # (signatures, queries) similarities of this block
+            scores = self.signatureMatrix @ self.normMatrix[chunk].toarray().T
+
+            if merge:
+                # Best similarity so far of every signature
+                block_best = scores.max(axis=1)
+                best = block_best if best is None else np.maximum(best, block_best)
+                continue
+
+            # Every query must not return itself
+            similars.extend(
+                self._expand(scores[:, column], n, [position]) for column, position in enumerate(chunk)
+            )
+
+        if merge:
+            return self._expand(best, n, positions)
+        return similars
+
+    def n_most_similar_batch(self, n:int, to_:list, indexes = False, merge = False):
+        """The ``n`` most similar items to every id in ``to_``, scored with a
+        few matrix-matrix products (see ``top_similar_batch``).
+
+        Unknown ids are skipped. Returns a dict ``{id: items}`` or, when
+        ``merge=True``, one deduplicated ranking where every item gets its
+        best similarity to any of the ids (ids passed are never returned)."""
+
+        # Positions of the ids found (first match if an id is repeated)
+        found = {id: self.position(id) for id in dict.fromkeys(to_)}
+        found = {id: position for id, position in found.items() if position is not None}
+        positions = np.fromiter(found.values(), dtype=np.intp, count=len(found))
+
+        if merge:
+            n_largest = self.top_similar_batch(positions, n, merge=True)
+            if indexes:
+                return self.index[n_largest]
+            return self.items.iloc[n_largest]
+
+        similars = {}
+        for id, n_largest in zip(found, self.top_similar_batch(positions, n)):
+            if indexes:
+                similars[id] = self.index[n_largest]
+            else:
+                similars[id] = self.items.iloc[n_largest]
+        return similars
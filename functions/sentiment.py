@@ -0,0 +1,220 @@
+import os
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import nltk
+from nltk.sentiment import SentimentIntensityAnalyzer
+
+from functions.pipeline import StageTimer, _map_ordered
+
+# Reviews with text (written by the ETL) and consumible reviews dataset
+REVIEWS_TEXT_PATH = './data/user_reviews_c.json.gz'
+REVIEWS_PATH = './data/reviews.csv.gz'
+
+# Labels already computed, by hash of the review text
+SENTIMENT_CACHE_PATH = './data/sentiment_cache.npz'
+
+REVIEWS_COLUMNS = ['user_id', 'item_id', 'recommend', 'sentiment']
+
+
+def compound_label(compound:float):
+    """Label of a VADER compound score, as in Notebook 2:
+    {0: Negative, 1: Neutral, 2: Positive}.
+
+    Scores between the thresholds were left unlabeled in the notebook
+    and then filled as neutral, so they are neutral here too."""
+    if compound < -0.05:
+        return 0
+    if compound >= 0.1:
+        return 2
+    return 1
+
+
+# ----------
+# Work done in the worker processes
+
+_analyser = None
+
+def _get_analyser():
+    """Private method. VADER analyser, created once per process."""
+    global _analyser
+    if _analyser is None:
+        try:
+            _analyser = SentimentIntensityAnalyzer()
+        except LookupError:
+            nltk.download('vader_lexicon', quiet=True)
+            _analyser = SentimentIntensityAnalyzer()
+    return _analyser
+
+
+def _score_batch(texts:list[str]):
+    """Private method. Labels of a batch of review texts.
+    Empty or missing texts are neutral."""
+    analyser = _get_analyser()
+    labels = [
+        compound_label(analyser.polarity_scores(text)['compound']) if isinstance(text, str) and text else 1
+        for text in texts
+    ]
+    return np.array(labels, dtype=np.int8)
+
+
+# ----------
+# Cache
+
+def text_hashes(texts):
+    """64-bit hash of every review text (missing texts hash as empty)."""
+    return np.fromiter(
+        (
+            int.from_bytes(
+                hashlib.blake2b((text if isinstance(text, str) else '').encode('utf-8'), digest_size=8).digest(),
+                'little'
+            )
+            for text in texts
+        ),
+        dtype=np.uint64,
+        count=len(texts)
+    )
+
+
+class SentimentCache:
+    """Sentiment labels by hash of the review text, saved as ``.npz``
+    so re-runs only score new or changed reviews."""
+
+    def __init__(self, path:str = SENTIMENT_CACHE_PATH):
+        self.path = path
+        self.hashes = np.array([], dtype=np.uint64)
+        self.labels = np.array([], dtype=np.int8)
+
+        if path is not None and os.path.exists(path):
+            with np.load(path) as data:
+                self.hashes, self.labels = data['hashes'], data['labels']
+
+        self._index = pd.Index(self.hashes)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def lookup(self, hashes:np.ndarray):
+        """Labels of ``hashes`` (-1 where the text was never scored)."""
+        positions = self._index.get_indexer(hashes)
+        labels = np.full(len(positions), -1, dtype=np.int8)
+        labels[positions >= 0] = self.labels[positions[positions >= 0]]
+        return labels
+
+    def update(self, hashes:np.ndarray, labels:np.ndarray):
+        """Adds new labels (``hashes`` must not be in the cache)."""
+        self.hashes = np.concatenate([self.hashes, hashes])
+        self.labels = np.concatenate([self.labels, labels])
+        self._index = pd.Index(self.hashes)
+
+    def save(self):
+        # np.savez adds '.npz' to the name, so the file is renamed into place
+        temporary = self.path + '.tmp.npz'
+        np.savez(temporary, hashes=self.hashes, labels=self.labels)
+        os.replace(temporary, self.path)
+
+
+# ----------
+# Scoring
+
+def score_texts(
+        texts,
+        cache:SentimentCache | None = None,
+        executor = None,
+        batch_size:int = 2000,
+        max_in_flight:int = 4,
+        timer:StageTimer | None = None
+    ):
+    """Sentiment label (0/1/2, int8) of every text.
+
+    Texts found in the ``cache`` are not scored again. Every distinct new
+    text is scored once, in batches of ``batch_size`` run in the
+    ``executor`` (None scores them here), and added to the cache."""
+
+    timer = timer or StageTimer()
+    if cache is None:
+        cache = SentimentCache(path=None)
+    texts = list(texts)
+
+    with timer.stage('sentiment: cache lookup'):
+        hashes = text_hashes(texts)
+        labels = cache.lookup(hashes)
+
+        # Distinct texts missing in the cache
+        missing = np.flatnonzero(labels < 0)
+        new_hashes, first = np.unique(hashes[missing], return_index=True)
+        new_texts = [texts[position] for position in missing[first]]
+
+    with timer.stage('sentiment: scoring'):
+        scored = []
+        batches = (
+            (new_texts[start:start + batch_size],)
+            for start in range(0, len(new_texts), batch_size)
+        )
+        _map_ordered(executor, _score_batch, batches, max_in_flight, scored.append)
+        new_labels = np.concatenate(scored) if scored else np.array([], dtype=np.int8)
+
+    with timer.stage('sentiment: cache update'):
+        cache.update(new_hashes, new_labels)
+        labels[missing] = cache.lookup(hashes[missing])
+
+    print(f'Sentiment: {len(texts)} reviews, {len(new_texts)} new texts scored, {len(missing)} cache misses')
+    return labels
+
+
+def run_sentiment(
+        source:str = REVIEWS_TEXT_PATH,
+        output:str = REVIEWS_PATH,
+        cache_path:str = SENTIMENT_CACHE_PATH,
+        workers:int | None = None,
+        batch_size:int = 2000
+    ):
+    """Labels the reviews in ``source`` (reviews with text) and writes
+    the consumible reviews dataset to ``output`` with the 'sentiment'
+    column, as Notebook 2 did. ``source`` is kept for the next run.
+
+    ## Parametters
+    - ``source``: reviews with a 'review' text column (.json.gz lines).
+    - ``output``: reviews dataset (.csv.gz) used by the API.
+    - ``cache_path``: labels already computed (``SentimentCache``).
+    - ``workers``: worker processes (all cores by default; 1 scores here).
+    - ``batch_size``: texts per batch sent to a worker."""
+
+    workers = workers or os.cpu_count()
+    timer = StageTimer()
+
+    with timer.stage('sentiment: read'):
+        reviews = pd.read_json(source, compression='gzip', lines=True)
+        cache = SentimentCache(cache_path)
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        reviews['sentiment'] = score_texts(
+            reviews['review'], cache, executor, batch_size, max_in_flight=2 * workers, timer=timer
+        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    with timer.stage('sentiment: write'):
+        cache.save()
+        reviews[REVIEWS_COLUMNS].to_csv(output, compression='gzip', index=False)
+
+    print(f'Reviews with sentiment saved at "{output}" ({len(cache)} texts cached)')
+    timer.report()
+    return reviews[REVIEWS_COLUMNS]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Label the sentiment of users reviews.')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores).')
+    parser.add_argument('--batch-size', type=int, default=2000, help='Texts per batch.')
+    parser.add_argument('--source', default=REVIEWS_TEXT_PATH, help='Reviews with text.')
+    parser.add_argument('--output', default=REVIEWS_PATH, help='Reviews dataset.')
+    parser.add_argument('--cache', default=SENTIMENT_CACHE_PATH, help='Labels cache.')
+    args = parser.parse_args()
+
+    run_sentiment(args.source, args.output, args.cache, args.workers, args.batch_size)
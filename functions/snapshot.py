@@ -0,0 +1,276 @@
+import os
+import json
+import pickle
+import hashlib
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from functions.ETL import load_df, compact_df, memory_report
+from functions.recomender import CosSimComputer
+from functions.preprocessing import preprocess_games, GamesPreprocessor
+from functions.aggregates import build_tables, item_popularity
+
+# Default location of the snapshot
+SNAPSHOT_PATH = './data/snapshot'
+
+# Location of a saved GamesPreprocessor
+PREPROCESSOR_PATH = './data/preprocessor.json'
+
+# Columns of games used by the API ('tags' is not needed)
+GAMES_COLUMNS = ['item_id', 'developer', 'app_name', 'genres', 'specs', 'release_year', 'price']
+
+# Version of the snapshot layout, increased on incompatible changes
+SNAPSHOT_FORMAT = 3
+
+# Arrays saved as .npy files, memory-mapped when loaded
+ARRAYS = [
+    'items_data', 'norm_data', 'indices', 'indptr', 'item_ids', 'index',
+    'signature_of', 'representatives', 'priority'
+]
+
+
+def _sha256(path:str):
+    """Private method. Checksum of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ----------
+# Building from the datasets
+
+def load_dataset(name:str):
+    """Reads a dataset the way the API uses it: only the needed columns,
+    with compact dtypes (see ``ETL.compact_df``)."""
+    columns = GAMES_COLUMNS if name == 'games' else None
+    df = compact_df(load_df(name, from_main=True, columns=columns, memory_map=True))
+    memory_report({name: df})
+    return df
+
+
+def fit_preprocessor(games:pd.DataFrame):
+    """Loads the saved preprocessor, so the layout of the items matrix
+    does not change between restarts, or fits a new one."""
+    if os.path.exists(PREPROCESSOR_PATH):
+        return GamesPreprocessor.load(PREPROCESSOR_PATH)
+    return GamesPreprocessor().fit(games)
+
+
+def build_computer(games:pd.DataFrame, preprocessor:GamesPreprocessor, items:pd.DataFrame | None = None):
+    """Fits a ``CosSimComputer`` with the preprocessed games. The dense
+    preprocessed frame is not kept: the computer stores its own sparse
+    version of the items matrix.
+
+    If ``items`` is given, ties between recommendations are broken by
+    popularity (number of owners) instead of position."""
+    computer = CosSimComputer(
+        preprocess_games(games, preprocessor),
+        columns=preprocessor.featureColumns
+    )
+    if items is not None:
+        computer.set_popularity(item_popularity(items, computer.items['item_id']))
+    return computer
+
+
+def build_state():
+    """Builds everything the API needs from the datasets: loads them,
+    fits (or loads) the preprocessor, fits the ``CosSimComputer`` and
+    builds the query tables.
+
+    Returns a dict with ``version`` (None), ``games``, ``reviews``,
+    ``items``, ``preprocessor``, ``computer`` and ``tables``."""
+
+    games, reviews, items = (
+        load_dataset(name) for name in ['games', 'reviews', 'items']
+    )
+    preprocessor = fit_preprocessor(games)
+
+    return {
+        'version': None,
+        'games': games,
+        'reviews': reviews,
+        'items': items,
+        'preprocessor': preprocessor,
+        'computer': build_computer(games, preprocessor, items),
+        'tables': build_tables(games, reviews, items)
+    }
+
+
+# ----------
+# Snapshot files
+
+def build_snapshot(state:dict, path:str = SNAPSHOT_PATH):
+    """Writes everything the API needs to start into a single versioned
+    snapshot folder, so no dataset has to be read or processed at startup.
+
+    Files created:
+        ``*.npy``: the items matrix (raw and L2-normalized CSR arrays),
+        item ids and index of the items, signatures and tie-breaking
+        priority. Memory-mapped when loaded.
+        ``games.pkl``: games columns used to build responses.
+        ``<table>.pkl``: every precomputed query table, one file each.
+        ``preprocessor.json``: the fitted ``GamesPreprocessor``.
+        ``manifest.json``: format, version, feature columns and checksums.
+
+    ## Parametters:
+    - state: dict returned by ``build_state``.
+    - path: Folder where files are saved."""
+
+    games, computer = state['games'], state['computer']
+    os.makedirs(path, exist_ok=True)
+
+    # Raw and normalized matrices share the sparsity structure
+    arrays = {
+        'items_data': computer.itemsMatrix.data,
+        'norm_data': computer.normMatrix.data,
+        'indices': computer.itemsMatrix.indices,
+        'indptr': computer.itemsMatrix.indptr,
+        'item_ids': computer.items['item_id'].to_numpy(),
+        'index': computer.index.to_numpy(),
+        'signature_of': computer.signatureOf,
+        'representatives': computer.representatives,
+        'priority': computer.priority
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f'{name}.npy'), array)
+
+    games.to_pickle(os.path.join(path, 'games.pkl'))
+    for name, table in state['tables'].items():
+        with open(os.path.join(path, f'{name}.pkl'), 'wb') as file:
+            pickle.dump(table, file, protocol=pickle.HIGHEST_PROTOCOL)
+    state['preprocessor'].save(os.path.join(path, 'preprocessor.json'))
+
+    # Checksum of every file and of the whole snapshot
+    names = (
+        [f'{name}.npy' for name in arrays]
+        + [f'{name}.pkl' for name in state['tables']]
+        + ['games.pkl', 'preprocessor.json']
+    )
+    files = {name: _sha256(os.path.join(path, name)) for name in sorted(names)}
+    checksum = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': checksum[:12],
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'shape': list(computer.itemsMatrix.shape),
+        'columns': list(computer.columns),
+        'tables': sorted(state['tables']),
+        'files': files,
+        'checksum': checksum
+    }
+    with open(os.path.join(path, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    print(f'Snapshot {manifest["version"]} saved at "{path}"')
+    return manifest
+
+
+def snapshot_exists(path:str = SNAPSHOT_PATH):
+    return os.path.exists(os.path.join(path, 'manifest.json'))
+
+
+def read_manifest(path:str = SNAPSHOT_PATH):
+    """Reads the manifest of the snapshot saved at ``path``. The
+    folder is stored in it, so every part can be loaded on its own."""
+
+    with open(os.path.join(path, 'manifest.json')) as file:
+        manifest = json.load(file)
+
+    if manifest['format'] != SNAPSHOT_FORMAT:
+        raise ValueError(
+            f"Snapshot format {manifest['format']} is not supported (expected {SNAPSHOT_FORMAT})"
+        )
+
+    manifest['path'] = path
+    return manifest
+
+
+def _snapshot_file(manifest:dict, name:str, verify=True):
+    """Private method. Path of a snapshot file, checked against
+    its checksum when ``verify=True``."""
+    path = os.path.join(manifest['path'], name)
+    if verify and _sha256(path) != manifest['files'][name]:
+        raise ValueError(f'Snapshot file "{name}" is corrupted')
+    return path
+
+
+def load_snapshot_games(manifest:dict, verify=True):
+    return pd.read_pickle(_snapshot_file(manifest, 'games.pkl', verify))
+
+
+def load_snapshot_preprocessor(manifest:dict, verify=True):
+    return GamesPreprocessor.load(_snapshot_file(manifest, 'preprocessor.json', verify))
+
+
+def load_snapshot_table(manifest:dict, name:str, verify=True):
+    with open(_snapshot_file(manifest, f'{name}.pkl', verify), 'rb') as file:
+        return pickle.load(file)
+
+
+def load_snapshot_computer(manifest:dict, games:pd.DataFrame, verify=True):
+    """``CosSimComputer`` over the memory-mapped arrays of the snapshot,
+    so workers loading the same snapshot share pages through the OS cache."""
+
+    arrays = {
+        name: np.load(_snapshot_file(manifest, f'{name}.npy', verify), mmap_mode='r')
+        for name in ARRAYS
+    }
+    shape = tuple(manifest['shape'])
+    index = pd.Index(arrays['index'])
+
+    computer = CosSimComputer.from_matrices(
+        itemsMatrix=sparse.csr_matrix(
+            (arrays['items_data'], arrays['indices'], arrays['indptr']), shape=shape, copy=False
+        ),
+        normMatrix=sparse.csr_matrix(
+            (arrays['norm_data'], arrays['indices'], arrays['indptr']), shape=shape, copy=False
+        ),
+        items=games.loc[index, ['item_id', 'app_name']],
+        columns=manifest['columns'],
+        index=index,
+        signatureOf=arrays['signature_of'],
+        representatives=arrays['representatives'],
+        priority=arrays['priority']
+    )
+
+    print(f"Snapshot {manifest['version']} loaded. Items Matrix Shape: {shape}")
+    return computer
+
+
+def load_snapshot(path:str = SNAPSHOT_PATH, verify=True):
+    """Loads the whole snapshot saved by ``build_snapshot``.
+
+    Returns the same dict as ``build_state``, where ``version`` is the
+    snapshot version and ``reviews``/``items`` are None (every table
+    depending on them is already built). With ``verify=True`` every file
+    is checked against its checksum."""
+
+    manifest = read_manifest(path)
+    games = load_snapshot_games(manifest, verify)
+
+    return {
+        'version': manifest['version'],
+        'games': games,
+        'reviews': None,
+        'items': None,
+        'preprocessor': load_snapshot_preprocessor(manifest, verify),
+        'computer': load_snapshot_computer(manifest, games, verify),
+        'tables': {
+            name: load_snapshot_table(manifest, name, verify) for name in manifest['tables']
+        }
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the API snapshot.')
+    parser.add_argument('--path', default=SNAPSHOT_PATH, help='Output folder.')
+    args = parser.parse_args()
+
+    build_snapshot(build_state(), path=args.path)
@@ -1,13 +1,88 @@
-from typing import Annotated
-from fastapi import FastAPI, Query
+import os
+from typing import Annotated, Literal
+from fastapi import FastAPI, Query, Request, Response
+from fastapi.responses import JSONResponse
 
 """Importing queries script where all enpoint functions are stored
-Dataframes are loaded there"""
+Dataframes are loaded there (on first use)"""
 import functions.queries as queries
+from functions.cache import ResponseCache
+from functions.ingest import InboxWatcher
 
 
 app = FastAPI()
 
+# Responses are cached in memory for CACHE_TTL seconds (and dropped as
+# soon as the data changes). Set with the API_CACHE_SIZE and API_CACHE_TTL
+# environment variables.
+CACHE_TTL = int(os.environ.get('API_CACHE_TTL', 3600))
+cache = ResponseCache(
+    maxsize=int(os.environ.get('API_CACHE_SIZE', 1024)),
+    ttl=CACHE_TTL,
+    version=queries.data_version
+)
+
+# Seconds between inbox ingestions (None: no live ingestion, see watch_inbox)
+INBOX_INTERVAL = os.environ.get('API_INBOX_INTERVAL')
+
+# Seconds clients/CDN may reuse a response without asking again
+# (API_CLIENT_MAX_AGE). They cannot know when the data changes, so with
+# live ingestion the default is 0: responses are revalidated every time
+# with their ETag (cheap 304 when nothing changed).
+CLIENT_MAX_AGE = int(os.environ.get('API_CLIENT_MAX_AGE', 0 if INBOX_INTERVAL else CACHE_TTL))
+CACHE_CONTROL = f'public, max-age={CLIENT_MAX_AGE}' if CLIENT_MAX_AGE > 0 else 'public, no-cache'
+
+# Maximum number of item ids accepted by /RecSys/batch
+BATCH_MAX_IDS = 500
+
+def cached(request:Request, response:Response, function, *args, **kwargs):
+    """Answers ``function(*args, **kwargs)`` from the cache, with ETag and
+    Cache-Control headers. Returns 304 (no body) when the client already
+    has the same response (``If-None-Match``)."""
+
+    entry = cache.get(function, *args, **kwargs)
+    headers = {'ETag': entry.etag, 'Cache-Control': CACHE_CONTROL}
+    if request.headers.get('if-none-match') == entry.etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return entry.value
+
+@app.exception_handler(queries.UnknownItemError)
+def unknown_item(request:Request, exc:queries.UnknownItemError):
+    """Unknown item ids are answered with 404."""
+    return JSONResponse(status_code=404, content={'detail': f'Item {exc.args[0]} not found'})
+
+@app.exception_handler(queries.UnknownGenreError)
+def unknown_genre(request:Request, exc:queries.UnknownGenreError):
+    """Unknown genres are answered with 404."""
+    return JSONResponse(status_code=404, content={'detail': f'Genre {exc.args[0]} not found'})
+
+@app.on_event("startup")
+def warmup():
+    """Optional warm up. Data is loaded on first use unless the
+    ``API_WARMUP`` environment variable is set: 'all', or a comma
+    separated list of query functions (e.g. 'game_recommend,PlayTimeGenre')."""
+
+    endpoints = os.environ.get('API_WARMUP')
+    if not endpoints:
+        return
+    if endpoints.strip() == 'all':
+        queries.warmup()
+    else:
+        # Spaces around the names are allowed ('game_recommend, PlayTimeGenre')
+        queries.warmup([name.strip() for name in endpoints.split(',') if name.strip()])
+
+@app.on_event("startup")
+def watch_inbox():
+    """Optional ingestion of new data. When the ``API_INBOX_INTERVAL``
+    environment variable is set, files dropped in ``data/inbox`` are
+    ingested every that many seconds while requests are served.
+    Run it in a single API process (e.g. one uvicorn worker)."""
+
+    if not INBOX_INTERVAL:
+        return
+    InboxWatcher(interval=float(INBOX_INTERVAL)).start()
+
 @app.get("/")
 async def root():
     return {
@@ -16,6 +91,8 @@ async def root():
 
 @app.get("/PlayTime")
 def PlayTimeGenre(
+    request: Request,
+    response: Response,
     genre: Annotated[
         str,
         Query(
@@ -27,11 +104,12 @@ def PlayTimeGenre(
     """Return year with the highest number 
     of hours played for the provided genre"""
     
-    response = queries.PlayTimeGenre(genre)
-    return response
+    return cached(request, response, queries.PlayTimeGenre, genre)
 
 @app.get("/Users")
 def UserForGenre(
+    request: Request,
+    response: Response,
     genre: Annotated[
         str,
         Query(
@@ -42,11 +120,12 @@ def UserForGenre(
     """Return the user with the most hours 
     played given the genre."""
 
-    response = queries.UserForGenre(genre)
-    return response
+    return cached(request, response, queries.UserForGenre, genre)
 
 @app.get("/UserRec")
 def UsersRecommend(
+    request: Request,
+    response: Response,
     year: Annotated[
         int,
         Query(
@@ -57,11 +136,12 @@ def UsersRecommend(
     """Return the Top 3 most recommended games 
     during the given year."""
 
-    response = queries.UsersRecommend(year)
-    return response
+    return cached(request, response, queries.UsersRecommend, year)
 
 @app.get("/WorstDev")
 def UsersWorstDeveloper(
+    request: Request,
+    response: Response,
     year: Annotated[
         int,
         Query(
@@ -72,29 +152,37 @@ def UsersWorstDeveloper(
     """Top 3 developers with the least recommended 
     games for the given year."""
 
-    response = queries.UsersWorstDeveloper(year)
-    return response
+    return cached(request, response, queries.UsersWorstDeveloper, year)
 
 @app.get("/Sentiment")
 def sentiment_analysis(
+    request: Request,
+    response: Response,
     dev: Annotated[
         str,
         Query(
             description = "Developer name"
         )
-    ]
+    ],
+    match: Annotated[
+        Literal['exact', 'insensitive', 'prefix'],
+        Query(
+            description = "How the developer name is matched"
+        )
+    ] = 'exact'
 ):
     """Type the name of some Developer company and 
     it will return the total Positive, Negative and 
     Neutral comments.
     """
 
-    response = queries.sentiment_analysis(dev)
-    return response
+    return cached(request, response, queries.sentiment_analysis, dev, match=match)
 
 # Rec Sys
 @app.get('/RecSys')
 def game_recommend(
+    request: Request,
+    response: Response,
     item_id: Annotated[
         int,
         Query(
@@ -104,11 +192,63 @@ def game_recommend(
     n: Annotated[
         int,
         Query(
-            description = "The `n` most similar"
+            description = "The `n` most similar",
+            ge = 1
+        )
+    ] = 5,
+    approximate: Annotated[
+        bool,
+        Query(
+            description = "Use the approximate (faster, less accurate) engine"
         )
-    ] = 5
+    ] = False
 ):
     """The n most similar games to the item passed"""
 
-    response = queries.game_recommend(n_sim=n, to_id=item_id)
-    return response
\ No newline at end of file
+    return cached(
+        request, response, queries.game_recommend, n_sim=n, to_id=item_id, approximate=approximate
+        )
+
+@app.get('/RecSys/batch')
+def game_recommend_batch(
+    request: Request,
+    response: Response,
+    item_ids: Annotated[
+        list[int] | None,
+        Query(
+            description = f"Unique ids for games (at most {BATCH_MAX_IDS})",
+            max_length = BATCH_MAX_IDS
+        )
+    ] = None,
+    user_id: Annotated[
+        str | None,
+        Query(
+            description = "User whose library is added to the item ids"
+        )
+    ] = None,
+    n: Annotated[
+        int,
+        Query(
+            description = "The `n` most similar",
+            ge = 1
+        )
+    ] = 5,
+    merge: Annotated[
+        bool,
+        Query(
+            description = "Return a single deduplicated ranking"
+        )
+    ] = False
+):
+    """The n most similar games to every item passed,
+    or a single ranking for all of them"""
+
+    return cached(
+        request, response, queries.game_recommend_batch,
+        n_sim=n, to_ids=item_ids, user_id=user_id, merge=merge
+        )
+
+@app.get('/cache')
+def cache_stats():
+    """Hits and misses of the response cache"""
+    return cache.stats()